@@ -0,0 +1,204 @@
+import json
+import os
+import warnings
+import numpy as np
+
+# Search engines for cosine similarity over the scaled nutrition matrix.
+# Every engine exposes the same kneighbors() signature as sklearn's
+# NearestNeighbors, so it can be dropped into build_pipeline() unchanged.
+
+
+def normalize_rows(data):
+    data=np.asarray(data,dtype=np.float64)
+    norms=np.linalg.norm(data,axis=1,keepdims=True)
+    norms[norms==0]=1.0
+    return data/norms
+
+def inverse_norms(data):
+    # 1/||row|| as float32, so cosine similarity is a product with the raw rows
+    norms=np.linalg.norm(np.asarray(data,dtype=np.float64),axis=1)
+    norms[norms==0]=1.0
+    return (1.0/norms).astype(np.float32)
+
+def _as_2d(X,n_features):
+    return np.asarray(X,dtype=np.float64).reshape(-1,n_features)
+
+def top_k(scores,rows,k):
+    # The k highest scores per line and their rows, selected with argpartition
+    # and only those k sorted: highest score first, lowest row on ties
+    k=min(k,scores.shape[1])
+    if k<1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    top=np.argpartition(-scores,k-1,axis=1)[:,:k]
+    scores=np.take_along_axis(scores,top,axis=1)
+    rows=np.take_along_axis(np.broadcast_to(rows,top.shape[:1]+rows.shape[-1:]),top,axis=1)
+    order=np.lexsort((rows,-scores),axis=1)
+    return np.take_along_axis(scores,order,axis=1),np.take_along_axis(rows,order,axis=1)
+
+def cosine_top_k(X,data,inv_norms,rows,k):
+    # Cosine similarity of normalized float32 queries with data, one GEMV per
+    # query (a GEMM for a batch), then top_k()
+    scores=(X@data.T)*inv_norms
+    return top_k(scores,rows,k)
+
+
+class BruteForceEngine:
+    # Exact search, the reference the approximate engines are measured against.
+    # The scaled matrix is kept in float32 with its inverse row norms. All
+    # queries are scored with one matrix product per block of corpus rows,
+    # keeping a running top-k per query between blocks
+    name='brute'
+    arrays=('data','inv_norms')
+    settings=('working_memory',)
+
+    def __init__(self,data,working_memory=8_000_000):
+        self.data=np.asarray(data,dtype=np.float32)
+        self.inv_norms=inverse_norms(data)
+        self.working_memory=working_memory
+
+    def kneighbors(self,X,n_neighbors=5,return_distance=True):
+        X=normalize_rows(_as_2d(X,self.data.shape[1])).astype(np.float32)
+        n_rows=self.data.shape[0]
+        block_size=max(1024,self.working_memory//max(1,X.shape[0]))
+        best_scores=np.empty((X.shape[0],0),dtype=np.float32)
+        best_rows=np.empty((X.shape[0],0),dtype=np.int64)
+        for start in range(0,n_rows,block_size):
+            stop=min(start+block_size,n_rows)
+            scores,rows=cosine_top_k(X,self.data[start:stop],self.inv_norms[start:stop],np.arange(start,stop),n_neighbors)
+            best_scores,best_rows=top_k(np.hstack([best_scores,scores]),np.hstack([best_rows,rows]),n_neighbors)
+        distances=1.0-best_scores.astype(np.float64)
+        return (distances,best_rows) if return_distance else best_rows
+
+
+class IVFEngine:
+    # Inverted file index in pure NumPy: rows are clustered with spherical
+    # k-means and a query only scores the rows of its nprobe closest clusters
+    name='ivf'
+    arrays=('unit','centroids','order','offsets')
+    settings=('n_features','n_lists','nprobe')
+
+    def __init__(self,data,n_lists=None,nprobe=8,n_iter=10,sample_size=50000,block_size=65536,random_state=0):
+        self.unit=normalize_rows(data).astype(np.float32)
+        n_rows,self.n_features=self.unit.shape
+        self.n_lists=max(1,min(n_rows,n_lists or int(np.sqrt(n_rows))))
+        self.nprobe=max(1,min(nprobe,self.n_lists))
+        rng=np.random.default_rng(random_state)
+        sample=self.unit[rng.choice(n_rows,min(n_rows,sample_size),replace=False)]
+        centroids=sample[rng.choice(sample.shape[0],self.n_lists,replace=False)]
+        for _ in range(n_iter):
+            assignment=np.argmax(sample@centroids.T,axis=1)
+            sums=np.zeros_like(centroids)
+            np.add.at(sums,assignment,sample)
+            filled=np.bincount(assignment,minlength=self.n_lists)>0
+            centroids[filled]=normalize_rows(sums[filled])
+        self.centroids=centroids
+        self.block_size=block_size
+        self.set_lists(self.assign(self.unit))
+
+    def assign(self,unit):
+        return np.concatenate([
+            np.argmax(unit[start:start+self.block_size]@self.centroids.T,axis=1)
+            for start in range(0,unit.shape[0],self.block_size)
+        ]) if unit.shape[0] else np.empty(0,dtype=np.int64)
+
+    def set_lists(self,assignment):
+        # Rows grouped by cluster, cluster i owning order[offsets[i]:offsets[i+1]]
+        self.order=np.argsort(assignment,kind='stable')
+        self.offsets=np.concatenate([[0],np.cumsum(np.bincount(assignment,minlength=self.n_lists))])
+
+    def candidates(self,query):
+        probe=np.argsort(-(self.centroids@query),kind='stable')[:self.nprobe]
+        return np.sort(np.concatenate([self.order[self.offsets[i]:self.offsets[i+1]] for i in probe]))
+
+    def kneighbors(self,X,n_neighbors=5,return_distance=True):
+        X=normalize_rows(_as_2d(X,self.n_features)).astype(np.float32)
+        distances=np.empty((X.shape[0],n_neighbors))
+        indices=np.empty((X.shape[0],n_neighbors),dtype=np.int64)
+        for i,query in enumerate(X):
+            rows=self.candidates(query)
+            if rows.shape[0]<n_neighbors:
+                rows=np.arange(self.unit.shape[0])
+            scores,found=top_k((self.unit[rows]@query)[np.newaxis],rows,n_neighbors)
+            distances[i],indices[i]=1.0-scores[0],found[0]
+        return (distances,indices) if return_distance else indices
+
+
+class HNSWEngine:
+    # Hierarchical navigable small world graph from the optional hnswlib package.
+    # The graph is saved with hnswlib's own format and loaded into each process,
+    # it cannot be memory-mapped like the NumPy engines
+    name='hnsw'
+    arrays=()
+    settings=('n_features','ef')
+
+    def __init__(self,data,M=16,ef_construction=200,ef=64,random_state=0):
+        import hnswlib
+        data=np.asarray(data,dtype=np.float32)
+        self.n_features=data.shape[1]
+        self.index=hnswlib.Index(space='cosine',dim=self.n_features)
+        self.index.init_index(max_elements=data.shape[0],ef_construction=ef_construction,M=M,random_seed=random_state)
+        self.index.add_items(data,np.arange(data.shape[0]))
+        self.ef=ef
+
+    @property
+    def ef(self):
+        return self.index.ef
+
+    @ef.setter
+    def ef(self,ef):
+        self.index.set_ef(ef)
+
+    def save_state(self,path):
+        self.index.save_index(os.path.join(path,'hnsw.bin'))
+
+    def load_state(self,path,settings):
+        import hnswlib
+        self.index=hnswlib.Index(space='cosine',dim=settings['n_features'])
+        self.index.load_index(os.path.join(path,'hnsw.bin'))
+
+    def kneighbors(self,X,n_neighbors=5,return_distance=True):
+        # hnswlib searches with max(ef,k) for each query, the tuned ef of the
+        # shared graph is left alone
+        indices,distances=self.index.knn_query(_as_2d(X,self.n_features),k=n_neighbors)
+        indices=indices.astype(np.int64)
+        return (distances.astype(np.float64),indices) if return_distance else indices
+
+
+ENGINES={engine.name:engine for engine in (BruteForceEngine,IVFEngine,HNSWEngine)}
+
+def make_engine(name,data,**options):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown search engine '{name}', expected one of {sorted(ENGINES)}")
+    if name=='hnsw':
+        try:
+            import hnswlib  # noqa: F401
+        except ImportError:
+            warnings.warn("hnswlib is not installed, falling back to the NumPy IVF engine")
+            return IVFEngine(data)
+    return ENGINES[name](data,**options)
+
+# Bumped whenever the arrays saved by an engine change
+ENGINE_FORMAT=2
+
+def save_engine(engine,path):
+    # Arrays are stored as .npy files so load_engine() can memory-map them and
+    # every process serving the same files shares one physical copy
+    for name in engine.arrays:
+        np.save(os.path.join(path,f'{name}.npy'),getattr(engine,name))
+    if hasattr(engine,'save_state'):
+        engine.save_state(path)
+    with open(os.path.join(path,'engine.json'),'w') as f:
+        json.dump({'name':engine.name,'settings':{name:getattr(engine,name) for name in engine.settings}},f)
+
+def load_engine(path):
+    with open(os.path.join(path,'engine.json')) as f:
+        saved=json.load(f)
+    cls=ENGINES[saved['name']]
+    engine=cls.__new__(cls)
+    for name in cls.arrays:
+        setattr(engine,name,np.load(os.path.join(path,f'{name}.npy'),mmap_mode='r'))
+    if hasattr(engine,'load_state'):
+        engine.load_state(path,saved['settings'])
+    for name,value in saved['settings'].items():
+        setattr(engine,name,value)
+    return engine
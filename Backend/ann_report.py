@@ -0,0 +1,86 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from model import scaling
+from ann import ENGINES, make_engine
+
+# Recall@k versus latency of the approximate engines against exact brute force
+# search, e.g.
+#   python ann_report.py --rows 500000 --k 5 20 --output ann_report.json
+
+# Query time settings swept over a single build of each engine
+SWEEPS={
+    'brute':[{}],
+    'ivf':[{'nprobe':nprobe} for nprobe in (1,2,4,8,16,32)],
+    'hnsw':[{'ef':ef} for ef in (16,32,64,128,256)],
+}
+
+def upsample(features,n_rows,rng):
+    # Grow the corpus to n_rows by jittering resampled recipes
+    if n_rows<=features.shape[0]:
+        return features[:n_rows]
+    extra=features[rng.integers(0,features.shape[0],n_rows-features.shape[0])]
+    extra=extra*rng.lognormal(0.0,0.1,extra.shape)
+    return np.vstack([features,extra])
+
+def percentile_ms(latencies,q):
+    return round(float(np.percentile(latencies,q))*1000,4)
+
+def run_engine(engine,queries,k,truth):
+    latencies=[]
+    hits=0
+    for query,expected in zip(queries,truth):
+        start=time.perf_counter()
+        found=engine.kneighbors(query.reshape(1,-1),n_neighbors=k,return_distance=False)[0]
+        latencies.append(time.perf_counter()-start)
+        hits+=np.intersect1d(found,expected).shape[0]
+    return {
+        'recall':round(hits/(k*queries.shape[0]),4),
+        'p50_ms':percentile_ms(latencies,50),
+        'p95_ms':percentile_ms(latencies,95),
+        'p99_ms':percentile_ms(latencies,99),
+        'qps':round(len(latencies)/sum(latencies),1),
+    }
+
+def main():
+    parser=argparse.ArgumentParser(description='Recall@k versus latency of the search engines')
+    parser.add_argument('--data',default='../data/last_20000_rows.csv')
+    parser.add_argument('--rows',type=int,default=0,help='corpus size, upsampled from --data when larger')
+    parser.add_argument('--queries',type=int,default=200)
+    parser.add_argument('--k',type=int,nargs='+',default=[5])
+    parser.add_argument('--engines',nargs='+',default=list(SWEEPS),choices=sorted(ENGINES))
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',help='write the report as JSON to this file')
+    args=parser.parse_args()
+
+    rng=np.random.default_rng(args.seed)
+    features=pd.read_csv(args.data).iloc[:,6:15].to_numpy(dtype=np.float64)
+    features=upsample(features,args.rows or features.shape[0],rng)
+    prep_data,scaler=scaling(pd.DataFrame(np.hstack([np.zeros((features.shape[0],6)),features])))
+    queries=features[rng.integers(0,features.shape[0],args.queries)]*rng.lognormal(0.0,0.2,(args.queries,features.shape[1]))
+    queries=scaler.transform(queries)
+
+    exact=make_engine('brute',prep_data)
+    report={'rows':int(features.shape[0]),'queries':args.queries,'results':[]}
+    for k in args.k:
+        truth=exact.kneighbors(queries,n_neighbors=k,return_distance=False)
+        for name in args.engines:
+            start=time.perf_counter()
+            engine=make_engine(name,prep_data)
+            build_seconds=time.perf_counter()-start
+            for options in SWEEPS[name]:
+                for option,value in options.items():
+                    setattr(engine,option,value)
+                result={'engine':name,'options':options,'k':k,'build_s':round(build_seconds,3)}
+                result.update(run_engine(engine,queries,k,truth))
+                report['results'].append(result)
+                print(f"{name:6} {json.dumps(options):16} k={k:<3} recall={result['recall']:.4f} "
+                      f"p50={result['p50_ms']:.3f}ms p95={result['p95_ms']:.3f}ms build={result['build_s']}s",flush=True)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=2)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,238 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import warnings
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from ann import ENGINE_FORMAT, inverse_norms, load_engine, make_engine, save_engine
+from model import IngredientIndex, RecipeIndex, parse_records
+
+# Binary dataset artifact, written by ingest.py and loaded by the backend
+# without parsing the CSV. An artifact is a directory holding:
+#   meta.json                 format version, row count and column names
+#   nutrition.npy             float32 matrix of the nutrition columns (6-15),
+#                             memory-mapped at load
+#   records.bin               one JSON document per recipe, with the
+#   records_offsets.npy       ingredients and instructions already parsed;
+#                             row i is records.bin[offsets[i]:offsets[i+1]]
+#   ingredients.json          ingredient vocabulary, and the posting lists of
+#   ingredient_postings.npy   IngredientIndex concatenated, vocabulary entry i
+#   ingredient_offsets.npy    owning postings[offsets[i]:offsets[i+1]]
+#   search/                   scaled matrix and search engines, built on
+#                             first use by load_shared_recipe_index()
+#   image_links/              optional image link of every recipe, written by
+#                             images.py: links.bin and links_offsets.npy, row i
+#                             is links.bin[offsets[i]:offsets[i+1]], empty when
+#                             the recipe has no link
+
+ARTIFACT_FORMAT='diet-recipes'
+ARTIFACT_VERSION=1
+
+
+class TextStore:
+    # Offset indexed store of one JSON document per row, read through mmap
+    def __init__(self,path,offsets):
+        self.offsets=offsets
+        with open(path,'rb') as f:
+            self.data=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    def raw(self,row):
+        return self.data[self.offsets[row]:self.offsets[row+1]]
+
+    def __getitem__(self,row):
+        return json.loads(self.raw(row))
+
+    def __len__(self):
+        return self.offsets.shape[0]-1
+
+
+class LinkedRecords:
+    # Records with the image link of their row, when it has one
+    def __init__(self,records,links):
+        self.records=records
+        self.links=links
+
+    def __getitem__(self,row):
+        recipe=self.records[row]
+        link=self.links.raw(row)
+        if link:
+            recipe['image_link']=bytes(link).decode('utf-8')
+        return recipe
+
+    def __len__(self):
+        return len(self.records)
+
+
+def artifact_exists(path):
+    return os.path.isfile(os.path.join(path,'meta.json'))
+
+def chunk_offsets(chunks):
+    # Chunk i of the concatenation spans offsets[i]:offsets[i+1]
+    offsets=np.zeros(len(chunks)+1,dtype=np.int64)
+    offsets[1:]=np.cumsum([len(chunk) for chunk in chunks])
+    return offsets
+
+def write_artifact(dataframe,path):
+    # Written next to the destination and swapped in once complete, so a
+    # backend starting meanwhile never reads a partial artifact
+    records=parse_records(dataframe)
+    ingredient_index=IngredientIndex.from_parts([recipe['RecipeIngredientParts'] for recipe in records])
+    tmp_path=path+'.tmp'
+    shutil.rmtree(tmp_path,ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path,'nutrition.npy'),dataframe.iloc[:,6:15].to_numpy(dtype=np.float32))
+
+    encoded=[json.dumps(recipe,separators=(',',':')).encode('utf-8') for recipe in records]
+    with open(os.path.join(tmp_path,'records.bin'),'wb') as f:
+        f.writelines(encoded)
+    np.save(os.path.join(tmp_path,'records_offsets.npy'),chunk_offsets(encoded))
+
+    postings=ingredient_index.postings
+    offsets=chunk_offsets(postings)
+    postings=np.concatenate(postings).astype(np.int32) if postings else np.empty(0,dtype=np.int32)
+    with open(os.path.join(tmp_path,'ingredients.json'),'w') as f:
+        json.dump(ingredient_index.vocabulary,f)
+    np.save(os.path.join(tmp_path,'ingredient_postings.npy'),postings)
+    np.save(os.path.join(tmp_path,'ingredient_offsets.npy'),offsets)
+
+    with open(os.path.join(tmp_path,'meta.json'),'w') as f:
+        json.dump({
+            'format':ARTIFACT_FORMAT,
+            'version':ARTIFACT_VERSION,
+            'rows':len(records),
+            'columns':list(dataframe.columns),
+            'nutrition_columns':list(dataframe.columns[6:15]),
+        },f,indent=2)
+    swap_directory(tmp_path,path)
+
+def swap_directory(tmp_path,path):
+    if os.path.exists(path):
+        old_path=path+'.old'
+        shutil.rmtree(old_path,ignore_errors=True)
+        os.rename(path,old_path)
+        os.rename(tmp_path,path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path,path)
+
+def write_image_links(path,links):
+    # links holds the image link of every row of the artifact, None for none
+    meta=read_meta(path)
+    if len(links)!=meta['rows']:
+        raise ValueError(f"{len(links)} image links for the {meta['rows']} recipes of {path}")
+    links_path=os.path.join(path,'image_links')
+    tmp_path=links_path+'.tmp'
+    shutil.rmtree(tmp_path,ignore_errors=True)
+    os.makedirs(tmp_path)
+    encoded=[(link or '').encode('utf-8') for link in links]
+    with open(os.path.join(tmp_path,'links.bin'),'wb') as f:
+        f.writelines(encoded)
+    np.save(os.path.join(tmp_path,'links_offsets.npy'),chunk_offsets(encoded))
+    swap_directory(tmp_path,links_path)
+
+def read_meta(path):
+    with open(os.path.join(path,'meta.json')) as f:
+        meta=json.load(f)
+    if meta.get('format')!=ARTIFACT_FORMAT or meta.get('version')!=ARTIFACT_VERSION:
+        raise ValueError(f"{path} is a {meta.get('format')} v{meta.get('version')} artifact, "
+                         f"expected {ARTIFACT_FORMAT} v{ARTIFACT_VERSION}: run ingest.py again")
+    return meta
+
+def load_parts(path):
+    read_meta(path)
+    features=np.load(os.path.join(path,'nutrition.npy'),mmap_mode='r')
+    records=TextStore(os.path.join(path,'records.bin'),np.load(os.path.join(path,'records_offsets.npy')))
+    links_path=os.path.join(path,'image_links')
+    if os.path.isdir(links_path):
+        records=LinkedRecords(records,TextStore(os.path.join(links_path,'links.bin'),np.load(os.path.join(links_path,'links_offsets.npy'))))
+    with open(os.path.join(path,'ingredients.json')) as f:
+        vocabulary=json.load(f)
+    postings=np.load(os.path.join(path,'ingredient_postings.npy'),mmap_mode='r')
+    offsets=np.load(os.path.join(path,'ingredient_offsets.npy'))
+    ingredient_index=IngredientIndex(
+        vocabulary,
+        [postings[offsets[i]:offsets[i+1]] for i in range(len(vocabulary))],
+        features.shape[0],
+    )
+    return features,records,ingredient_index
+
+def load_recipe_index(path,**options):
+    return RecipeIndex(*load_parts(path),**options)
+
+@contextmanager
+def file_lock(path):
+    with open(path,'w') as f:
+        fcntl.flock(f,fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f,fcntl.LOCK_UN)
+
+def build_once(path,build):
+    # Runs build(directory) in a single process, the other workers wait on the
+    # lock and then find the finished directory
+    if os.path.isdir(path):
+        return
+    with file_lock(path+'.lock'):
+        if os.path.isdir(path):
+            return
+        tmp_path=path+'.tmp'
+        shutil.rmtree(tmp_path,ignore_errors=True)
+        os.makedirs(tmp_path)
+        build(tmp_path)
+        os.rename(tmp_path,path)
+
+def save_scaled(features,path):
+    scaler=StandardScaler()
+    prep_data=scaler.fit_transform(np.asarray(features,dtype=np.float64))
+    np.save(os.path.join(path,'prep_data.npy'),prep_data.astype(np.float32))
+    np.save(os.path.join(path,'inv_norms.npy'),inverse_norms(prep_data))
+    np.savez(os.path.join(path,'scaler.npz'),mean=scaler.mean_,var=scaler.var_,scale=scaler.scale_,n_samples_seen=scaler.n_samples_seen_)
+
+def load_scaled(path):
+    saved=np.load(os.path.join(path,'scaler.npz'))
+    scaler=StandardScaler()
+    scaler.mean_,scaler.var_,scaler.scale_=saved['mean'],saved['var'],saved['scale']
+    scaler.n_samples_seen_=int(saved['n_samples_seen'])
+    scaler.n_features_in_=scaler.mean_.shape[0]
+    return (
+        scaler,
+        np.load(os.path.join(path,'prep_data.npy'),mmap_mode='r'),
+        np.load(os.path.join(path,'inv_norms.npy'),mmap_mode='r'),
+    )
+
+def engine_key(engine,engine_options):
+    options=json.dumps([ENGINE_FORMAT,engine_options or {}],sort_keys=True)
+    return f"{engine}-{hashlib.sha1(options.encode('utf-8')).hexdigest()[:12]}"
+
+def load_shared_recipe_index(path,subset_scaling=True,engine='brute',engine_options=None):
+    # Like load_recipe_index(), but the scaled matrix and the search engine are
+    # kept as files under path/search and memory-mapped, so every uvicorn worker
+    # serving the artifact shares one physical copy through the page cache
+    features,records,ingredient_index=load_parts(path)
+    search_path=os.path.join(path,'search')
+    try:
+        os.makedirs(search_path,exist_ok=True)
+        scaled_path=os.path.join(search_path,f'scaled-v{ENGINE_FORMAT}')
+        build_once(scaled_path,lambda tmp_path:save_scaled(features,tmp_path))
+        scaler,prep_data,inv_norms=load_scaled(scaled_path)
+        engine_path=os.path.join(search_path,engine_key(engine,engine_options))
+        build_once(engine_path,lambda tmp_path:save_engine(make_engine(engine,prep_data,**(engine_options or {})),tmp_path))
+        neigh=load_engine(engine_path)
+    except OSError as e:
+        warnings.warn(f"Could not share the search index under {search_path} ({e}), building it in this process")
+        return RecipeIndex(features,records,ingredient_index,subset_scaling=subset_scaling,engine=engine,engine_options=engine_options)
+    return RecipeIndex(features,records,ingredient_index,subset_scaling=subset_scaling,
+                       scaler=scaler,prep_data=prep_data,inv_norms=inv_norms,neigh=neigh)
+
+def load_dataset_index(data_path,artifact_path,**options):
+    # From the artifact when there is one, from the CSV otherwise
+    if artifact_exists(artifact_path):
+        return load_shared_recipe_index(artifact_path,**options)
+    return RecipeIndex.from_dataframe(pd.read_csv(data_path),**options)
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    # Bounded LRU cache of /predict/ responses, keyed by the (optionally
+    # quantized) nutrition input, the ingredients and the params.
+    #
+    # Entries remember the version of the recipe index they were computed from,
+    # and are dropped when read against a different version, so a dataset
+    # change invalidates the cache without an explicit flush.
+    def __init__(self,maxsize=1024,ttl=None,quantum=None):
+        self.maxsize=maxsize
+        self.ttl=ttl
+        self.quantum=quantum
+        self.hits=0
+        self.misses=0
+        self._entries=OrderedDict()
+        self._lock=threading.Lock()
+
+    def quantize(self,nutrition_input):
+        # Inputs in the same quantum step share an entry, the search should run
+        # on the quantized input so that the entry is the same for all of them
+        if not self.quantum:
+            return [float(value) for value in nutrition_input]
+        return [round(value/self.quantum)*self.quantum for value in nutrition_input]
+
+    def key(self,nutrition_input,ingredients,params):
+        return (
+            tuple(self.quantize(nutrition_input)),
+            tuple(sorted({ingredient.strip().lower() for ingredient in ingredients if ingredient.strip()})),
+            tuple(sorted(params.items())),
+        )
+
+    def get(self,key,version):
+        with self._lock:
+            entry=self._entries.get(key)
+            if entry is not None:
+                value,entry_version,expires=entry
+                if entry_version==version and (expires is None or expires>time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits+=1
+                    return value
+                del self._entries[key]
+            self.misses+=1
+            return None
+
+    def put(self,key,value,version):
+        if self.maxsize<=0:
+            return
+        expires=time.monotonic()+self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key]=(value,version,expires)
+            self._entries.move_to_end(key)
+            while len(self._entries)>self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups=self.hits+self.misses
+            return {
+                'size':len(self._entries),
+                'maxsize':self.maxsize,
+                'ttl':self.ttl,
+                'quantum':self.quantum,
+                'hits':self.hits,
+                'misses':self.misses,
+                'hit_rate':self.hits/lookups if lookups else 0.0,
+            }
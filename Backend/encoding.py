@@ -0,0 +1,54 @@
+import json
+import math
+
+# JSON encoding of the responses. orjson is used when installed, the standard
+# library otherwise. Recipes are encoded once (RecipeIndex.recipe_json) and the
+# documents of the responses are assembled around these fragments, without
+# validating the data of our own dataset against the response models again.
+# Both encode NaN and infinite floats as null, the standard library would
+# otherwise write NaN and Infinity, which is not JSON.
+
+try:
+    import orjson
+except ImportError:
+    orjson=None
+
+
+def finite(value):
+    # The value with its NaN and infinite floats replaced by None
+    if isinstance(value,float):
+        return value if math.isfinite(value) else None
+    if isinstance(value,dict):
+        return {key:finite(item) for key,item in value.items()}
+    if isinstance(value,(list,tuple)):
+        return [finite(item) for item in value]
+    return value
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value,option=orjson.OPT_SERIALIZE_NUMPY)
+    try:
+        return json.dumps(value,separators=(',',':'),ensure_ascii=False,allow_nan=False).encode('utf-8')
+    except ValueError:
+        # Copied only when the value holds such a float
+        return json.dumps(finite(value),separators=(',',':'),ensure_ascii=False,allow_nan=False).encode('utf-8')
+
+
+class RawJSON(bytes):
+    # Already encoded JSON, spliced as is by encode()
+    pass
+
+
+def encode(document):
+    if isinstance(document,RawJSON):
+        return document
+    if isinstance(document,dict):
+        if not any(isinstance(value,(RawJSON,dict,list)) for value in document.values()):
+            return dumps(document)
+        return b'{'+b','.join(dumps(str(key))+b':'+encode(value) for key,value in document.items())+b'}'
+    if isinstance(document,list):
+        if not any(isinstance(value,(RawJSON,dict,list)) for value in document):
+            return dumps(document)
+        return b'['+b','.join(encode(value) for value in document)+b']'
+    return dumps(document)
@@ -0,0 +1,172 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+from functools import partial
+from journal import Journal, JournaledIndex
+from metrics import NULL_TRACE, Trace
+
+# Where the searches of the endpoints run:
+#   inline   in the request thread
+#   thread   in a pool of threads, the NumPy work releases the GIL
+#   process  in a pool of processes, each holding its own index loaded from
+#            the dataset (memory-mapped and shared with the artifact) and
+#            following the journal, so one backend process uses every core
+# At most max_queue searches are submitted or running at once, the next ones
+# are refused with ExecutorBusy, and a search not done after timeout seconds
+# raises TimeoutError in the request (it still runs to completion).
+# The stages of a search are timed on the trace passed to predict() or run(),
+# the time waiting for a worker is charged to its queue stage.
+#
+# predict() answers a /predict/ request with its response body. run() calls a
+# search function (find, find_batch) with the index and returns the found rows,
+# which the request encodes from its own index. With both, a process worker
+# serving another version of the recipes is not used, the search then runs
+# inline on the index of the request.
+
+MODES=('inline','thread','process')
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+# Index of a process pool worker
+worker_index=None
+
+def init_worker(load,journal_path):
+    global worker_index
+    worker_index=JournaledIndex(load,Journal(journal_path))
+
+def search_body(index,nutrition_input,ingredients,params,trace=NULL_TRACE):
+    trace.lap('queue')
+    found=index.search(nutrition_input,ingredients,params,trace)
+    body=index.prediction_json(found,params['return_distance'])
+    trace.lap('encode')
+    trace.size('recipes',0 if found is None else found[1].shape[0])
+    return body
+
+def find(index,nutrition_input,ingredients,params,trace=NULL_TRACE):
+    trace.lap('queue')
+    found=index.search(nutrition_input,ingredients,params,trace)
+    trace.size('recipes',0 if found is None else found[1].shape[0])
+    return found
+
+def find_batch(index,inputs,ingredients_list,params_list,trace=NULL_TRACE):
+    trace.lap('queue')
+    return index.search_batch(inputs,ingredients_list,params_list)
+
+def predict_in_worker(nutrition_input,ingredients,params):
+    trace=Trace()
+    index=worker_index.current()
+    return index.version,search_body(index,nutrition_input,ingredients,params,trace),trace
+
+def run_in_worker(function,args):
+    trace=Trace()
+    index=worker_index.current()
+    return index.version,function(index,*args,trace=trace),trace
+
+
+class SearchExecutor:
+    def __init__(self,mode='inline',workers=None,max_queue=0,timeout=None,load=None,journal_path=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown executor '{mode}', expected one of {list(MODES)}")
+        self.mode=mode
+        self.workers=workers or os.cpu_count()
+        self.max_queue=max_queue
+        self.timeout=timeout
+        self.in_flight=0
+        self._slots_lock=threading.Lock()
+        self._load=load
+        self._journal_path=journal_path
+        self._pool=None
+        self._pool_lock=threading.Lock()
+
+    def pool(self):
+        # Started on first use, after uvicorn forked its workers
+        with self._pool_lock:
+            if self._pool is None:
+                if self.mode=='thread':
+                    self._pool=concurrent.futures.ThreadPoolExecutor(self.workers,thread_name_prefix='search')
+                else:
+                    self._pool=concurrent.futures.ProcessPoolExecutor(
+                        self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=init_worker,
+                        initargs=(self._load,self._journal_path),
+                    )
+            return self._pool
+
+    def start(self):
+        # Starts every worker of a process pool, each loading its index
+        if self.mode=='process':
+            for future in [self.pool().submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+
+    def acquire(self):
+        with self._slots_lock:
+            if self.max_queue and self.in_flight>=self.max_queue:
+                raise ExecutorBusy()
+            self.in_flight+=1
+
+    def release(self,future=None):
+        with self._slots_lock:
+            self.in_flight-=1
+
+    def submit(self,function,*args):
+        # Future of function(*args) on the pool, holding a slot until done
+        self.acquire()
+        try:
+            future=self.pool().submit(function,*args)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def result(self,future):
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Search not done after {self.timeout}s")
+
+    def predict(self,index,nutrition_input,ingredients,params,trace=NULL_TRACE):
+        # /predict/ response body of the request. Outside of a process pool the
+        # given index is searched
+        if self.mode=='inline':
+            return search_body(index,nutrition_input,ingredients,params,trace)
+        if self.mode=='thread':
+            return self.result(self.submit(search_body,index,nutrition_input,ingredients,params,trace))
+        version,body,worker_trace=self.result(self.submit(predict_in_worker,nutrition_input,ingredients,params))
+        if version!=index.version:
+            return search_body(index,nutrition_input,ingredients,params,trace)
+        if trace is not NULL_TRACE:
+            trace.merge(worker_trace)
+        return body
+
+    def run(self,index,function,*args,trace=NULL_TRACE):
+        # function(index,*args) on the executor, its result holds rows of index
+        if self.mode=='inline':
+            return function(index,*args,trace=trace)
+        if self.mode=='thread':
+            return self.result(self.submit(partial(function,index,*args,trace=trace)))
+        version,result,worker_trace=self.result(self.submit(run_in_worker,function,args))
+        if version!=index.version:
+            return function(index,*args,trace=trace)
+        if trace is not NULL_TRACE:
+            trace.merge(worker_trace)
+        return result
+
+    def stats(self):
+        return {
+            'mode':self.mode,
+            'workers':self.workers if self.mode!='inline' else 0,
+            'max_queue':self.max_queue,
+            'in_flight':self.in_flight,
+            'timeout':self.timeout,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False,cancel_futures=True)
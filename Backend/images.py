@@ -0,0 +1,139 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from artifact import load_parts, write_image_links
+
+# Precomputes the image link of every recipe of an artifact written by
+# ingest.py, so that /predict/ returns image_link with the recipes and the
+# pages never search images on the request path, e.g.
+#   python images.py ../data/last_20000_rows.artifact --workers 8 --rate 4
+# Each distinct recipe name is resolved once by a provider of the frontend
+# image finder (Frontend/ImageFinder), called as provider(session, name,
+# timeout) and returning a link or None; --provider module:function picks
+# another one. Lookups run on --workers threads, at most --rate per second.
+#
+# Every answer is appended to a checkpoint file next to the artifact, and an
+# interrupted run resumes from it. Failed lookups are not recorded and are
+# tried again by the next run. At the end the links known so far are written
+# to the artifact (image_links/), served once the backend reloads it. An
+# artifact written again by ingest.py has no links: running images.py again
+# writes them back from the checkpoint, resolving only the new names.
+
+FRONTEND=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Frontend')
+DEFAULT_PROVIDER='ImageFinder.ImageFinder:google_images'
+
+
+class RateLimiter:
+    # At most rate calls per second over all threads, spread evenly
+    def __init__(self,rate):
+        self.interval=1.0/rate if rate else 0.0
+        self.next=time.monotonic()
+        self._lock=threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now=time.monotonic()
+            at=max(self.next,now)
+            self.next=at+self.interval
+        if at>now:
+            time.sleep(at-now)
+
+
+def load_provider(spec):
+    sys.path.append(FRONTEND)
+    module,_,function=spec.partition(':')
+    return getattr(importlib.import_module(module),function)
+
+def read_checkpoint(path):
+    # Name -> link (None when nothing was found) of the names already resolved
+    links={}
+    if os.path.exists(path):
+        with open(path,encoding='utf-8') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    entry=json.loads(line)
+                    links[entry['name']]=entry['link']
+    return links
+
+def resolve_names(names,provider,checkpoint_path,workers=8,rate=4.0,timeout=10.0,progress_every=10.0):
+    session=requests.Session()
+    adapter=HTTPAdapter(pool_connections=workers,pool_maxsize=workers,pool_block=True)
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    limiter=RateLimiter(rate)
+
+    def lookup(name):
+        limiter.wait()
+        try:
+            return name,provider(session,name,timeout),None
+        except Exception as e:
+            return name,None,e
+
+    resolved=found=failed=0
+    started=last_report=time.monotonic()
+    pending=iter(names)
+    running=set()
+    with ThreadPoolExecutor(workers,thread_name_prefix='image') as pool,open(checkpoint_path,'a',encoding='utf-8') as checkpoint:
+        while True:
+            # A bounded window of lookups in flight, not one future per name
+            for name in pending:
+                running.add(pool.submit(lookup,name))
+                if len(running)>=4*workers:
+                    break
+            if not running:
+                break
+            done,running=wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                name,link,error=future.result()
+                if error is not None:
+                    failed+=1
+                    print(f"Lookup of {name!r} failed: {error}",flush=True)
+                    continue
+                checkpoint.write(json.dumps({'name':name,'link':link})+'\n')
+                resolved+=1
+                found+=link is not None
+            checkpoint.flush()
+            if time.monotonic()-last_report>progress_every:
+                last_report=time.monotonic()
+                print(f"{resolved} resolved ({found} found, {failed} failed) of {len(names)}, "
+                      f"{resolved/(last_report-started):.1f}/s",flush=True)
+    return resolved,found,failed
+
+def main():
+    parser=argparse.ArgumentParser(description='Precompute the image links of the recipes of an artifact')
+    parser.add_argument('artifact',nargs='?',default='../data/last_20000_rows.artifact')
+    parser.add_argument('--checkpoint',help='defaults to the artifact path with an .images.ndjson extension')
+    parser.add_argument('--provider',default=DEFAULT_PROVIDER,help='module:function, with Frontend/ on the path')
+    parser.add_argument('--workers',type=int,default=8)
+    parser.add_argument('--rate',type=float,default=4.0,help='lookups per second, 0 for no limit')
+    parser.add_argument('--timeout',type=float,default=10.0,help='seconds per lookup')
+    parser.add_argument('--limit',type=int,default=0,help='resolve at most this many names in this run')
+    args=parser.parse_args()
+    checkpoint_path=args.checkpoint or os.path.splitext(args.artifact)[0]+'.images.ndjson'
+
+    _,records,_=load_parts(args.artifact)
+    row_names=[records[row]['Name'] for row in range(len(records))]
+    links=read_checkpoint(checkpoint_path)
+    names=[name for name in dict.fromkeys(row_names) if name not in links]
+    if args.limit:
+        names=names[:args.limit]
+    print(f"{len(row_names)} recipes, {len(links)} names in the checkpoint, {len(names)} to resolve",flush=True)
+    if names:
+        resolved,found,failed=resolve_names(names,load_provider(args.provider),checkpoint_path,args.workers,args.rate,args.timeout)
+        print(f"Resolved {resolved} names ({found} found), {failed} failed",flush=True)
+        links=read_checkpoint(checkpoint_path)
+
+    write_image_links(args.artifact,[links.get(name) for name in row_names])
+    with_link=sum(links.get(name) is not None for name in row_names)
+    print(f"Wrote the image links of {with_link} of {len(row_names)} recipes to {args.artifact}, "
+          f"reload the backend (POST /admin/reload) to serve them")
+
+if __name__=='__main__':
+    main()
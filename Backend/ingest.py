@@ -0,0 +1,23 @@
+import argparse
+import os
+import time
+import pandas as pd
+from artifact import write_artifact
+
+# Converts the recipe CSV into the binary artifact loaded by main.py, e.g.
+#   python ingest.py ../data/last_20000_rows.csv
+# writes ../data/last_20000_rows.artifact
+
+def main():
+    parser=argparse.ArgumentParser(description='Convert the recipe CSV into a binary artifact')
+    parser.add_argument('csv',nargs='?',default='../data/last_20000_rows.csv')
+    parser.add_argument('artifact',nargs='?',help='defaults to the CSV path with an .artifact extension')
+    args=parser.parse_args()
+    path=args.artifact or os.path.splitext(args.csv)[0]+'.artifact'
+    start=time.perf_counter()
+    dataframe=pd.read_csv(args.csv)
+    write_artifact(dataframe,path)
+    print(f"Wrote {dataframe.shape[0]} recipes to {path} in {time.perf_counter()-start:.2f}s")
+
+if __name__=='__main__':
+    main()
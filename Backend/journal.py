@@ -0,0 +1,166 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Append-only log of the changes made to the served recipes through the admin
+# endpoints, one JSON document per line:
+#   {"op": "append", "recipes": [...]}    recipes added at the end
+#   {"op": "retire", "recipe_ids": [...]} recipes no longer recommended
+#   {"op": "reload"}                      rebuild from the dataset on disk
+# The dataset on disk is never modified, the journal is replayed on top of it
+# at startup. Every worker process follows the journal, so a change posted to
+# one worker reaches the others.
+#
+# A change is applied before it is written: an entry the index refuses (e.g. a
+# recipe id already served) never reaches the journal. An entry that still
+# fails on replay is logged and skipped, the others are applied.
+
+
+class Journal:
+    def __init__(self,path):
+        self.path=path
+        self.offset=0
+        self._lock=threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        # The journal opened for appending, no other process writes until exit
+        with open(self.path,'ab') as f:
+            fcntl.flock(f,fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f,fcntl.LOCK_UN)
+
+    def write(self,f,entry):
+        # Appends the entry to the journal opened by locked(), returns the
+        # offset after it
+        f.write((json.dumps(entry,separators=(',',':'))+'\n').encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+    def append(self,entry):
+        with self.locked() as f:
+            self.write(f,entry)
+
+    def changed(self):
+        try:
+            return os.path.getsize(self.path)!=self.offset
+        except FileNotFoundError:
+            return self.offset!=0
+
+    def read(self,start=None):
+        # Entries after the last one read (or from start), a line still being
+        # written is left for the next call
+        with self._lock:
+            try:
+                with open(self.path,'rb') as f:
+                    if start is None and os.fstat(f.fileno()).st_size<self.offset:
+                        # Truncated: the changes are dropped, back to the dataset
+                        start=0
+                        reset=[{'op':'reload'}]
+                    else:
+                        reset=[]
+                    f.seek(self.offset if start is None else start)
+                    data=f.read()
+            except FileNotFoundError:
+                reset=[{'op':'reload'}] if self.offset else []
+                self.offset=0
+                return reset
+            complete=data.rfind(b'\n')+1
+            self.offset=(self.offset if start is None else start)+complete
+            return reset+[json.loads(line) for line in data[:complete].splitlines() if line.strip()]
+
+
+def apply_entry(index,entry):
+    if entry['op']=='append':
+        return index.appended(entry['recipes'])
+    if entry['op']=='retire':
+        return index.retired(entry['recipe_ids'])
+    return index
+
+def apply_entries(index,entries):
+    for entry in entries:
+        try:
+            index=apply_entry(index,entry)
+        except Exception:
+            logging.getLogger(__name__).exception('Skipped a recipe journal entry that cannot be applied: %.200s',json.dumps(entry))
+    return index
+
+
+class JournaledIndex:
+    # The served RecipeIndex: load() over the dataset on disk with the journal
+    # replayed on top. A change builds a new index next to the served one and
+    # swaps it in, requests already running finish on the index they started
+    # with and the version invalidates cached results.
+    #
+    # The version is the journal offset the index was built up to, so every
+    # process following the journal gives the same data the same version. A
+    # truncated journal starts the versions over, on_reset() is then called
+    # to drop what was cached under the earlier ones
+    def __init__(self,load,journal,on_reset=None):
+        self.load=load
+        self.journal=journal
+        self.on_reset=on_reset
+        self._lock=threading.Lock()
+        self.index=apply_entries(load(),journal.read())
+        self.index.version=journal.offset
+
+    def sync(self):
+        # Applies the entries written since the last sync, by this process or
+        # by another one, and publishes the resulting index
+        with self._lock:
+            return self._sync()
+
+    def _sync(self):
+        entries=self.journal.read()
+        if not entries:
+            return self.index
+        if any(entry['op']=='reload' for entry in entries):
+            index=apply_entries(self.load(),self.journal.read(start=0))
+        else:
+            index=apply_entries(self.index,entries)
+        return self.publish(index)
+
+    def publish(self,index):
+        # The index under the version of the journal offset, on a copy when
+        # nothing changed: the served index may be in use by running requests
+        # and is not modified
+        if index is self.index:
+            index=index.with_version(self.journal.offset)
+        index.version=self.journal.offset
+        if index.version<=self.index.version and self.on_reset is not None:
+            self.on_reset()
+        self.index=index
+        return index
+
+    def change(self,entry):
+        # Applies the entry on top of the journal and writes it, holding the
+        # journal lock so no other process writes in between. Nothing is
+        # written when applying it raises
+        with self._lock,self.journal.locked() as f:
+            self._sync()
+            if entry['op']=='reload':
+                index=apply_entries(self.load(),self.journal.read(start=0))
+            else:
+                index=apply_entry(self.index,entry)
+            self.journal.offset=self.journal.write(f,entry)
+            return self.publish(index)
+
+    def current(self):
+        # The index, synced first when the journal changed
+        return self.sync() if self.journal.changed() else self.index
+
+    def follow(self,poll=1.0):
+        while True:
+            time.sleep(poll)
+            if self.journal.changed():
+                try:
+                    self.sync()
+                except Exception:
+                    logging.getLogger(__name__).exception('Could not apply the recipe journal %s',self.journal.path)
@@ -1,8 +1,23 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
-import pandas as pd
-from model import recommend, output_recommended_recipes
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional
+from model import NUTRITION_COLUMNS, DuplicateRecipe
+from artifact import load_dataset_index
+from cache import ResultCache
+from journal import Journal, JournaledIndex
+from executor import ExecutorBusy, SearchExecutor, find, find_batch
+from encoding import RawJSON, dumps, encode
+from metrics import BYTE_BUCKETS, SIZE_BUCKETS, Registry, Trace
+from plan import ACTIVITY_LEVELS, MEAL_SPLITS, PLANS, calculate_bmr, calories_calculator, diversified, meal_targets
+from optimizer import best_combinations
+import numpy as np
+from enum import Enum
+import random
+from functools import partial
+import threading
 
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -11,18 +26,138 @@ import bcrypt
 import jwt
 import datetime
 from pymongo import MongoClient
+import os
+import json
+
+
+
+
+# Fitting the scaler and the neighbour search once for the whole dataset.
+# RECOMMENDER_FILTER_SCALING=global scores ingredient filtered requests with the
+# global scaler instead of re-standardizing the matching subset.
+# RECOMMENDER_ENGINE selects the search engine (brute, ivf or hnsw) and
+# RECOMMENDER_ENGINE_OPTIONS passes it JSON keyword arguments, e.g. '{"nprobe": 16}'
+index_options = dict(
+    subset_scaling=os.getenv("RECOMMENDER_FILTER_SCALING", "subset") != "global",
+    engine=os.getenv("RECOMMENDER_ENGINE", "brute"),
+    engine_options=json.loads(os.getenv("RECOMMENDER_ENGINE_OPTIONS", "{}")),
+)
+
+# Reading the dataset, from the binary artifact written by ingest.py when there
+# is one and from the CSV otherwise. With the artifact, the matrices and search
+# structures are memory-mapped files shared by all the worker processes
+DATA_PATH = os.getenv("RECOMMENDER_DATA", "../data/last_20000_rows.csv")
+ARTIFACT_PATH = os.getenv("RECOMMENDER_ARTIFACT", os.path.splitext(DATA_PATH)[0] + ".artifact")
+
+# Recipes added or retired by the admin endpoints are written to the journal
+# (RECOMMENDER_JOURNAL) and replayed over the dataset. A change builds a new
+# index next to the served one and swaps it in, requests already running finish
+# on the index they started with and the cache is invalidated by the version
+JOURNAL_PATH = os.getenv("RECOMMENDER_JOURNAL", os.path.splitext(DATA_PATH)[0] + ".journal.ndjson")
+JOURNAL_POLL = float(os.getenv("RECOMMENDER_JOURNAL_POLL", "1"))
+journal = Journal(JOURNAL_PATH)
+served = JournaledIndex(partial(load_dataset_index, DATA_PATH, ARTIFACT_PATH, **index_options), journal)
+
+# Cache of /predict/ responses. RECOMMENDER_CACHE_SIZE bounds the number of
+# entries (0 disables it), RECOMMENDER_CACHE_TTL expires them after some seconds
+# and RECOMMENDER_CACHE_QUANTUM rounds the nutrition input to that step
+result_cache = ResultCache(
+    maxsize=int(os.getenv("RECOMMENDER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RECOMMENDER_CACHE_TTL", "0")) or None,
+    quantum=float(os.getenv("RECOMMENDER_CACHE_QUANTUM", "0")) or None,
+)
+# Versions start over when the journal is truncated, the entries cached under
+# the earlier ones must not be served
+served.on_reset = result_cache.clear
+ 
+# Executor of the searches of /predict/ (streamed or not), /predict/batch and
+# the plan endpoints: RECOMMENDER_EXECUTOR is inline (in the request thread),
+# thread or process, with RECOMMENDER_EXECUTOR_WORKERS workers (the CPU count
+# by default). RECOMMENDER_EXECUTOR_QUEUE caps the searches in flight, requests
+# beyond get a 503, and RECOMMENDER_EXECUTOR_TIMEOUT answers a 504 after that
+# many seconds. A process pool is started by each uvicorn worker,
+# run a single uvicorn worker with it
+search_executor = SearchExecutor(
+    mode=os.getenv("RECOMMENDER_EXECUTOR", "inline"),
+    workers=int(os.getenv("RECOMMENDER_EXECUTOR_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("RECOMMENDER_EXECUTOR_QUEUE", "0")),
+    timeout=float(os.getenv("RECOMMENDER_EXECUTOR_TIMEOUT", "0")) or None,
+    load=served.load,
+    journal_path=JOURNAL_PATH,
+)
+
+# Metrics served by /metrics in the Prometheus text format. Each uvicorn worker
+# keeps its own, label the scrape targets by worker when running several
+metrics = Registry()
+predict_seconds = metrics.histogram(
+    "recommender_predict_seconds", "Time answering /predict/ once the request is parsed", labelnames=("cache",))
+stage_seconds = metrics.histogram(
+    "recommender_predict_stage_seconds", "Time in each stage of /predict/: parse, cache, queue, filter, scale, knn, encode",
+    labelnames=("stage",))
+result_recipes = metrics.histogram("recommender_predict_recipes", "Recipes returned by a /predict/ search", SIZE_BUCKETS)
+filtered_rows = metrics.histogram(
+    "recommender_filtered_rows", "Recipes matching the ingredients of a filtered /predict/ search", SIZE_BUCKETS)
+response_bytes = metrics.histogram("recommender_predict_response_bytes", "Size of the /predict/ response bodies", BYTE_BUCKETS)
+metrics.counter("recommender_cache_hits_total", "/predict/ responses answered from the cache", lambda: result_cache.hits)
+metrics.counter("recommender_cache_misses_total", "/predict/ responses not found in the cache", lambda: result_cache.misses)
+metrics.gauge("recommender_cache_hit_ratio", "Share of the /predict/ cache lookups that hit", lambda: result_cache.stats()["hit_rate"])
+metrics.gauge("recommender_cache_entries", "Responses held by the /predict/ cache", lambda: result_cache.stats()["size"])
+metrics.gauge("recommender_executor_in_flight", "Searches submitted to the executor and not done", lambda: search_executor.in_flight)
+metrics.gauge("recommender_index_version", "Version of the served recipe index", lambda: served.index.version)
+metrics.gauge("recommender_index_recipes", "Recipes served", lambda: served.index.n_active)
+
+def observe_prediction(trace, cache, body=None):
+    for stage, seconds in trace.stages.items():
+        stage_seconds.observe(seconds, stage)
+    predict_seconds.observe(trace.total(), cache)
+    if "recipes" in trace.sizes:
+        result_recipes.observe(trace.sizes["recipes"])
+    if "filtered_rows" in trace.sizes:
+        filtered_rows.observe(trace.sizes["filtered_rows"])
+    if body is not None:
+        response_bytes.observe(len(body))
 
+app = FastAPI()
 
+@app.on_event("startup")
+def start_journal_follower():
+    threading.Thread(target=served.follow, args=(JOURNAL_POLL,), name="journal-follower", daemon=True).start()
+    search_executor.start()
+
+@app.on_event("shutdown")
+def stop_search_executor():
+    search_executor.shutdown()
+
+# Same 422 body as FastAPI's, but the rejected input is encoded with dumps():
+# a NaN or infinite value refused by a model is echoed back as null
+@app.exception_handler(RequestValidationError)
+def validation_error(request, exc):
+    return Response(content=dumps({"detail": jsonable_encoder(exc.errors())}), status_code=422, media_type="application/json")
+
+# Admin endpoints accept the tokens issued by the Admin service to admin users,
+# signed with SECRET_KEY and carrying an expiry. There is no default key: while
+# SECRET_KEY is not set the admin endpoints answer 503
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = "HS256"
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+def require_admin(token: str = Depends(oauth2_scheme)):
+    if not SECRET_KEY:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled, SECRET_KEY is not set.")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp"]})
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload
 
-# Reading the dataset
-dataset = pd.read_csv('../data/last_20000_rows.csv')
- 
-app = FastAPI()
+# Largest n_neighbors of a request, RECOMMENDER_MAX_NEIGHBORS
+MAX_NEIGHBORS = int(os.getenv("RECOMMENDER_MAX_NEIGHBORS", "1000"))
 
 # Define Params model to capture recommendation parameters
 class Params(BaseModel):
-    n_neighbors: int = 5
+    n_neighbors: int = Field(5, gt=0, le=MAX_NEIGHBORS)
     return_distance: bool = False
 
 # Input data model for prediction
@@ -48,44 +183,384 @@ class Recipe(BaseModel):
     SugarContent: float
     ProteinContent: float
     RecipeInstructions: List[str]
+    image_link: Optional[str] = None  # Precomputed by images.py, when available
+
+# Recipe added through the admin endpoint, NaN and infinite values are refused
+class RecipeIn(Recipe):
+    model_config = ConfigDict(allow_inf_nan=False)
+
+    RecipeId: int
+
+# Recipes to stop recommending
+class RetireIn(BaseModel):
+    recipe_ids: List[int]
 
 # Output model for prediction response
 class PredictionOut(BaseModel):
     output: Optional[List[Recipe]] = None
+    distances: Optional[List[float]] = None  # Cosine distances of the recipes, only with params.return_distance
+
+# Nutrition values of a recipe, other recipe fields are ignored
+class Nutrition(BaseModel):
+    Calories: float
+    FatContent: float
+    SaturatedFatContent: float
+    CholesterolContent: float
+    SodiumContent: float
+    CarbohydrateContent: float
+    FiberContent: float
+    SugarContent: float
+    ProteinContent: float
+
+# Bounds of a nutrient over the day
+class Bounds(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+# Largest number of combinations a request can ask for
+MAX_COMBINATIONS = 100
+
+# Largest profile a plan is computed for, beyond them the calorie targets
+# are meaningless
+MAX_AGE = 120
+MAX_HEIGHT = 300  # cm
+MAX_WEIGHT = 500  # kg
+
+class CombinationsIn(BaseModel):
+    meals: List[List[Nutrition]]  # Candidate recipes of each meal
+    target_calories: float
+    bounds: Dict[str, Bounds] = {}  # Keyed by nutrition column, e.g. {"ProteinContent": {"min": 100}}
+    combinations: int = Field(1, ge=1, le=MAX_COMBINATIONS)  # Number of combinations returned
+
+# One recipe per meal, as positions in the candidates of each meal
+class CombinationOut(BaseModel):
+    choices: List[int]
+    totals: Dict[str, float]
+    score: float  # Relative calorie error plus relative bound violations, lower is better
+
+# Person profile of the day plan, with the choices of the automatic diet page
+Gender = Enum("Gender", {"Male": "Male", "Female": "Female"}, type=str)
+Activity = Enum("Activity", {level: level for level in ACTIVITY_LEVELS}, type=str)
+Plan = Enum("Plan", {plan: plan for plan in PLANS}, type=str)
+
+class PlanIn(BaseModel):
+    age: int = Field(gt=0, le=MAX_AGE)
+    height: float = Field(gt=0, le=MAX_HEIGHT)  # cm
+    weight: float = Field(gt=0, le=MAX_WEIGHT)  # kg
+    gender: Gender
+    activity: Activity
+    plan: Plan = Plan("Maintain weight")
+    meals_per_day: int = 3
+    ingredients: Optional[str] = None  # Semicolon-separated, applied to every meal
+    params: Optional[Params] = Params()
+    seed: Optional[int] = None  # Seed of the random nutrition targets, for repeatable plans
+    combinations: int = Field(0, ge=0, le=MAX_COMBINATIONS)  # Number of recipe combinations hitting the target calories to return
+    bounds: Dict[str, Bounds] = {}
+
+class MealOut(PredictionOut):
+    meal: str
+    nutrition_input: List[float]
+
+class DayPlanOut(BaseModel):
+    bmr: float
+    maintain_calories: float
+    target_calories: float
+    meals: List[MealOut]
+    combinations: Optional[List[CombinationOut]] = None
+
+# Longest week plan, and most candidates shared out per meal: the re-rank
+# compares every candidate with every other one
+MAX_PLAN_DAYS = 31
+MAX_POOL = 2000
+
+class WeekPlanIn(PlanIn):
+    days: int = 7
+    diversity: float = 0.3  # 0 ranks by distance only, 1 by dissimilarity to the recipes already planned
+    pool: Optional[int] = None  # Candidates retrieved per meal, 2 * days * n_neighbors by default, at most MAX_POOL
+
+class DayOut(BaseModel):
+    day: int
+    meals: List[MealOut]
+    combinations: Optional[List[CombinationOut]] = None
+
+class WeekPlanOut(BaseModel):
+    bmr: float
+    maintain_calories: float
+    target_calories: float
+    days: List[DayOut]
 
 # Root endpoint for health check
 @app.get("/")
 def home():
     return {"health_check": "OK"}
 
-# Prediction endpoint
-@app.post("/predict/", response_model=PredictionOut)
-def update_item(prediction_input: PredictionIn):
+def parse_prediction_input(prediction_input: PredictionIn):
     # Manual validation of the nutrition_input length
     if len(prediction_input.nutrition_input) != 9:
         raise HTTPException(status_code=422, detail="nutrition_input must have exactly 9 items.")
     
     # Ensure params are passed correctly or use defaults
-    params = prediction_input.params.dict() if prediction_input.params else {}
+    params = prediction_input.params.dict() if prediction_input.params else Params().dict()
     
     # Split ingredients string by ";" if ingredients are provided and strip spaces
     ingredients = [ingredient.strip() for ingredient in prediction_input.ingredients.split(";")] if prediction_input.ingredients else []
+    return params, ingredients
+
+def prediction_output(index, found, params):
+    # Recommended recipes as the JSON encoded once per recipe, with their
+    # distances when requested. Fallback to empty list if no recommendations
+    if found is None:
+        return {"output": RawJSON(b"[]")}
+    distances, rows = found
+    output = {"output": RawJSON(index.recipes_json(rows))}
+    if params["return_distance"]:
+        output["distances"] = distances.tolist()
+    return output
+
+def found_recipes(index, found):
+    # Records of the recommended recipes, shared and not to be modified
+    return [] if found is None else index.output_recommended_recipes(found[1])
+
+def json_response(document):
+    # The documents are built from our own dataset: encoded directly instead of
+    # validated against the response model, which still documents them
+    return Response(content=encode(document), media_type="application/json")
+
+STREAM_CHUNK_SIZE = 16384
+
+def stream_recipes(index, found, params):
+    # One recipe per line in rank order, spliced from the encoded recipes, with
+    # its cosine distance when requested. Lines are sent in chunks of about
+    # STREAM_CHUNK_SIZE bytes, each chunk is a round trip to the threadpool
+    if found is None:
+        return
+    distances, rows = found
+    chunk = []
+    size = 0
+    for distance, row in zip(distances, rows):
+        fragment = index.recipe_json(row)
+        if params["return_distance"]:
+            fragment = fragment[:-1] + b',"distance":' + dumps(float(distance)) + b"}"
+        chunk.append(fragment)
+        size += len(fragment) + 1
+        if size >= STREAM_CHUNK_SIZE:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+            size = 0
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+def executed(search, *args, **kwargs):
+    # Result of a search on the executor: a full queue answers 503 and a
+    # search not done in time 504
+    try:
+        return search(*args, **kwargs)
+    except ExecutorBusy:
+        raise HTTPException(status_code=503, detail="Too many searches in progress.", headers={"Retry-After": "1"})
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="The search timed out.")
+
+# Prediction endpoint. With stream=true the recipes are sent as newline
+# delimited JSON as they are encoded, for large n_neighbors
+@app.post(
+    "/predict/",
+    response_model=PredictionOut,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+def update_item(prediction_input: PredictionIn, stream: bool = False):
+    trace = Trace()
+    params, ingredients = parse_prediction_input(prediction_input)
+    index = served.index
+    trace.lap("parse")
+    if stream:
+        found = executed(search_executor.run, index, find, prediction_input.nutrition_input, ingredients, params, trace=trace)
+        observe_prediction(trace, "stream")
+        return StreamingResponse(stream_recipes(index, found, params), media_type="application/x-ndjson")
     
-    # Call the recommend function with nutrition input and ingredients
-    recommendation_dataframe = recommend(
-        dataset, prediction_input.nutrition_input, ingredients, params
+    # Repeated queries are answered with the response body cached the first time
+    nutrition_input = result_cache.quantize(prediction_input.nutrition_input)
+    key = result_cache.key(nutrition_input, ingredients, params)
+    body = result_cache.get(key, index.version)
+    trace.lap("cache")
+    if body is not None:
+        observe_prediction(trace, "hit", body)
+        return Response(content=body, media_type="application/json")
+
+    # Search the index with nutrition input and ingredients, and encode the
+    # recommended recipes as output
+    body = executed(search_executor.predict, index, nutrition_input, ingredients, params, trace)
+    result_cache.put(key, body, index.version)
+    observe_prediction(trace, "miss", body)
+    return Response(content=body, media_type="application/json")
+
+# Hit and miss counters of the /predict/ cache
+@app.get("/cache")
+def cache_stats():
+    return result_cache.stats()
+
+# Mode and load of the search executor
+@app.get("/executor")
+def executor_stats():
+    return search_executor.stats()
+
+# Stage latencies, result sizes and cache counters for Prometheus
+@app.get("/metrics")
+def metrics_text():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Batch prediction endpoint, answering every item of the list in one search
+@app.post("/predict/batch", response_model=List[PredictionOut], response_model_exclude_none=True)
+def predict_batch(prediction_inputs: List[PredictionIn]):
+    index = served.index
+    parsed = [parse_prediction_input(prediction_input) for prediction_input in prediction_inputs]
+    found = executed(
+        search_executor.run, index, find_batch,
+        [prediction_input.nutrition_input for prediction_input in prediction_inputs],
+        [ingredients for params, ingredients in parsed],
+        [params for params, ingredients in parsed],
     )
-    
-    # Call the function to process the dataframe and output recommended recipes
-    output = output_recommended_recipes(recommendation_dataframe)
-    
-    # Return the recommended recipes as output, fallback to empty list if no recommendations
-    return {"output": output if output is not None else []}
+    return json_response([prediction_output(index, item, params) for item, (params, ingredients) in zip(found, parsed)])
+
 
 
 
 
 
+# Index with the change applied and journaled, 409 for a RecipeId already
+# served and 422 for other recipes the index refuses, nothing is journaled then
+def changed_index(entry):
+    try:
+        return served.change(entry)
+    except DuplicateRecipe as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+# Adding recipes to the served dataset
+@app.post("/admin/recipes")
+def append_recipes(recipes: List[RecipeIn], admin: dict = Depends(require_admin)):
+    index = changed_index({"op": "append", "recipes": [recipe.model_dump() for recipe in recipes]})
+    return {"message": f"{len(recipes)} recipes added", "recipes": index.n_active, "version": index.version}
+
+# Retiring recipes by RecipeId, they are no longer recommended
+@app.post("/admin/recipes/retire")
+def retire_recipes(retire: RetireIn, admin: dict = Depends(require_admin)):
+    index = changed_index({"op": "retire", "recipe_ids": retire.recipe_ids})
+    return {"message": "Recipes retired", "recipes": index.n_active, "version": index.version}
+
+# Reloading the dataset from disk, e.g. after ingest.py wrote a new artifact.
+# The journal is replayed over it and the current index serves meanwhile
+@app.post("/admin/reload")
+def reload_recipes(admin: dict = Depends(require_admin)):
+    index = changed_index({"op": "reload"})
+    return {"message": "Recipes reloaded", "recipes": index.n_active, "version": index.version}
+
+# Search of the recipe combinations closest to the target calories, exhaustive
+# when the product of the candidates is small and a beam search otherwise.
+# RECOMMENDER_OPTIMIZER_BUDGET bounds the exhaustive search, in seconds
+OPTIMIZER_BUDGET = float(os.getenv("RECOMMENDER_OPTIMIZER_BUDGET", "0.2"))
+
+def optimize_combinations(meals, target_calories, bounds, combinations):
+    unknown = sorted(set(bounds) - set(NUTRITION_COLUMNS))
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown nutrients in bounds: {unknown}.")
+    lower = [bounds[column].min if column in bounds and bounds[column].min is not None else np.nan for column in NUTRITION_COLUMNS]
+    upper = [bounds[column].max if column in bounds and bounds[column].max is not None else np.nan for column in NUTRITION_COLUMNS]
+    candidates = [np.array([[recipe[column] for column in NUTRITION_COLUMNS] for recipe in meal]).reshape(-1, len(NUTRITION_COLUMNS)) for meal in meals]
+    found = best_combinations(candidates, target_calories, lower, upper, n=combinations, budget=OPTIMIZER_BUDGET)
+    return [
+        {"choices": choices, "totals": dict(zip(NUTRITION_COLUMNS, totals.tolist())), "score": score}
+        for choices, totals, score in found
+    ]
+
+# Meal combination endpoint, for candidates the client already has
+@app.post("/plan/combinations", response_model=List[CombinationOut])
+def plan_combinations(combinations_input: CombinationsIn):
+    meals = [[recipe.dict() for recipe in meal] for meal in combinations_input.meals]
+    return json_response(optimize_combinations(meals, combinations_input.target_calories, combinations_input.bounds, combinations_input.combinations))
+
+def plan_targets(plan_input: PlanIn):
+    # Calorie needs of the person, meal targets and the parsed search options
+    if plan_input.meals_per_day not in MEAL_SPLITS:
+        raise HTTPException(status_code=422, detail=f"meals_per_day must be one of {sorted(MEAL_SPLITS)}.")
+    profile = (plan_input.age, plan_input.height, plan_input.weight, plan_input.gender.value)
+    maintain_calories = calories_calculator(*profile, plan_input.activity.value)
+    target_calories = maintain_calories * PLANS[plan_input.plan.value]
+    targets = meal_targets(target_calories, plan_input.meals_per_day, random.Random(plan_input.seed))
+    params, ingredients = parse_prediction_input(PredictionIn(
+        nutrition_input=targets[0][1], ingredients=plan_input.ingredients, params=plan_input.params,
+    ))
+    plan = {
+        "bmr": calculate_bmr(*profile),
+        "maintain_calories": maintain_calories,
+        "target_calories": target_calories,
+    }
+    return plan, targets, params, ingredients
+
+# Day plan endpoint: calorie needs, meal targets and the recommendations of
+# every meal, all meals answered by one batched search
+@app.post("/plan/day", response_model=DayPlanOut, response_model_exclude_none=True)
+def plan_day(plan_input: PlanIn):
+    index = served.index
+    plan, targets, params, ingredients = plan_targets(plan_input)
+    found = executed(
+        search_executor.run, index, find_batch,
+        [nutrition_input for meal, nutrition_input in targets],
+        [ingredients] * len(targets),
+        [params] * len(targets),
+    )
+    meals = [
+        {"meal": meal, "nutrition_input": nutrition_input, **prediction_output(index, item, params)}
+        for (meal, nutrition_input), item in zip(targets, found)
+    ]
+    plan["meals"] = meals
+    if plan_input.combinations > 0:
+        plan["combinations"] = optimize_combinations(
+            [found_recipes(index, item) for item in found], plan["target_calories"], plan_input.bounds, plan_input.combinations,
+        )
+    return json_response(plan)
+
+# Week plan endpoint: one search per meal slot for a pool of candidates large
+# enough for every day, shared out between the days by a diversity re-rank so
+# that recipes do not repeat across the week
+@app.post("/plan/week", response_model=WeekPlanOut, response_model_exclude_none=True)
+def plan_week(plan_input: WeekPlanIn):
+    if not 1 <= plan_input.days <= MAX_PLAN_DAYS:
+        raise HTTPException(status_code=422, detail=f"days must be between 1 and {MAX_PLAN_DAYS}.")
+    if plan_input.pool is not None and not 1 <= plan_input.pool <= MAX_POOL:
+        raise HTTPException(status_code=422, detail=f"pool must be between 1 and {MAX_POOL}.")
+    if not 0 <= plan_input.diversity <= 1:
+        raise HTTPException(status_code=422, detail="diversity must be between 0 and 1.")
+    index = served.index
+    plan, targets, params, ingredients = plan_targets(plan_input)
+    per_day = params["n_neighbors"]
+    # The pool is cut to the recipes matching the ingredients, the re-rank
+    # shares out what there is
+    pool = min(plan_input.pool or min(plan_input.days * per_day * 2, MAX_POOL), index.n_matching(ingredients))
+    if pool > 0:
+        found = executed(
+            search_executor.run, index, find_batch,
+            [nutrition_input for meal, nutrition_input in targets],
+            [ingredients] * len(targets),
+            [{**params, "n_neighbors": pool}] * len(targets),
+        )
+    else:
+        found = [None] * len(targets)
+    days = [{"day": day + 1, "meals": []} for day in range(plan_input.days)]
+    days_found = [[] for day in days]
+    for (meal, nutrition_input), item in zip(targets, found):
+        distances, rows = item if item is not None else (np.empty(0), np.empty(0, dtype=np.int64))
+        picks = diversified(1.0 - distances, index.unit_rows(rows), plan_input.days, per_day, plan_input.diversity)
+        for day, day_found, picked in zip(days, days_found, picks):
+            day_found.append((distances[picked], rows[picked]) if picked else None)
+            day["meals"].append({"meal": meal, "nutrition_input": nutrition_input, **prediction_output(index, day_found[-1], params)})
+    if plan_input.combinations > 0:
+        for day, day_found in zip(days, days_found):
+            day["combinations"] = optimize_combinations(
+                [found_recipes(index, item) for item in day_found], plan["target_calories"], plan_input.bounds, plan_input.combinations,
+            )
+    plan["days"] = days
+    return json_response(plan)
 
 """ 
 
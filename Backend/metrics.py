@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+
+# Metrics of the recommender in the Prometheus text format, served by
+# /metrics. An observation is a bisect and a few additions under a lock, cheap
+# enough to stay on for every request.
+#
+# A Trace follows one /predict/ request through its stages: lap(stage) charges
+# the time since the previous lap to that stage, and sizes holds the sizes seen
+# on the way (filtered rows, recipes returned). A trace filled in a process
+# pool worker is sent back with the result and merged into the request's one.
+
+# Seconds, from 50µs to 10s
+LATENCY_BUCKETS=(0.00005,0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+# Counts, of recipes or rows
+SIZE_BUCKETS=(0,1,5,10,20,50,100,1000,10000,100000,1000000)
+BYTE_BUCKETS=(1000,4000,16000,64000,256000,1000000,4000000)
+
+
+def format_value(value):
+    if value==float('inf'):
+        return '+Inf'
+    if isinstance(value,float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value,float) else str(value)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{'+','.join(f'{name}="{str(value)}"' for name,value in labels)+'}'
+
+
+class Histogram:
+    def __init__(self,name,documentation,buckets=LATENCY_BUCKETS,labelnames=()):
+        self.name=name
+        self.documentation=documentation
+        self.buckets=tuple(buckets)
+        self.labelnames=tuple(labelnames)
+        self.series={}
+        self._lock=threading.Lock()
+
+    def observe(self,value,*labels):
+        # labels in the order of labelnames
+        position=bisect.bisect_left(self.buckets,value)
+        with self._lock:
+            series=self.series.get(labels)
+            if series is None:
+                series=self.series[labels]=[[0]*(len(self.buckets)+1),0.0]
+            series[0][position]+=1
+            series[1]+=value
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.documentation}',f'# TYPE {self.name} histogram']
+        with self._lock:
+            series={labels:([*counts],total) for labels,(counts,total) in self.series.items()}
+        for labels,(counts,total) in sorted(series.items()):
+            named=list(zip(self.labelnames,labels))
+            cumulative=0
+            for bound,count in zip((*self.buckets,float('inf')),counts):
+                cumulative+=count
+                lines.append(f'{self.name}_bucket{format_labels(named+[("le",format_value(float(bound)))])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(named)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(named)} {cumulative}')
+        return lines
+
+
+class Samples:
+    # Counters and gauges read from elsewhere (e.g. the cache statistics) when
+    # the metrics are rendered
+    def __init__(self,name,documentation,kind,collect,labelnames=()):
+        self.name=name
+        self.documentation=documentation
+        self.kind=kind
+        self.collect=collect
+        self.labelnames=tuple(labelnames)
+
+    def render(self):
+        lines=[f'# HELP {self.name} {self.documentation}',f'# TYPE {self.name} {self.kind}']
+        samples=self.collect()
+        if not isinstance(samples,dict):
+            samples={():samples}
+        for labels,value in samples.items():
+            lines.append(f'{self.name}{format_labels(list(zip(self.labelnames,labels)))} {format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics=[]
+
+    def add(self,metric):
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self,*args,**kwargs):
+        return self.add(Histogram(*args,**kwargs))
+
+    def counter(self,name,documentation,collect,labelnames=()):
+        return self.add(Samples(name,documentation,'counter',collect,labelnames))
+
+    def gauge(self,name,documentation,collect,labelnames=()):
+        return self.add(Samples(name,documentation,'gauge',collect,labelnames))
+
+    def render(self):
+        lines=[]
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines)+'\n'
+
+
+class Trace:
+    def __init__(self):
+        self.started=self.last=time.perf_counter()
+        self.stages={}
+        self.sizes={}
+
+    def lap(self,stage):
+        now=time.perf_counter()
+        self.stages[stage]=self.stages.get(stage,0.0)+now-self.last
+        self.last=now
+
+    def size(self,name,value):
+        self.sizes[name]=value
+
+    def merge(self,other,stage='queue'):
+        # Stages of a trace filled elsewhere since the last lap, the rest of
+        # the time is charged to stage
+        now=time.perf_counter()
+        spent=sum(other.stages.values())
+        for name,seconds in other.stages.items():
+            self.stages[name]=self.stages.get(name,0.0)+seconds
+        self.stages[stage]=self.stages.get(stage,0.0)+max(now-self.last-spent,0.0)
+        self.sizes.update(other.sizes)
+        self.last=now
+
+    def total(self):
+        return self.last-self.started
+
+
+class NullTrace:
+    # Trace of the searches nobody measures
+    def lap(self,stage):
+        pass
+
+    def size(self,name,value):
+        pass
+
+NULL_TRACE=NullTrace()
@@ -1,11 +1,28 @@
+import copy
+from collections import Counter
 import numpy as np
 import re
 from sklearn.preprocessing import StandardScaler
 from sklearn.neighbors import NearestNeighbors
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import FunctionTransformer
+from ann import cosine_top_k, inverse_norms, make_engine, normalize_rows
+from encoding import dumps
+from metrics import NULL_TRACE
 
 
+NUTRITION_COLUMNS=['Calories','FatContent','SaturatedFatContent','CholesterolContent','SodiumContent','CarbohydrateContent','FiberContent','SugarContent','ProteinContent']
+
+# Fields of a recipe in the responses, in order
+RECIPE_FIELDS=['Name','CookTime','PrepTime','TotalTime','RecipeIngredientParts',*NUTRITION_COLUMNS,'RecipeInstructions']
+
+def encode_recipe(recipe):
+    fields={field:recipe[field] for field in RECIPE_FIELDS}
+    # Precomputed by images.py, or given with the recipes appended by an admin
+    if recipe.get('image_link'):
+        fields['image_link']=recipe['image_link']
+    return dumps(fields)
+
 def scaling(dataframe):
     scaler=StandardScaler()
     prep_data=scaler.fit_transform(dataframe.iloc[:,6:15].to_numpy())
@@ -46,12 +63,408 @@ def recommend(dataframe,_input,ingredients=[],params={'n_neighbors':5,'return_di
         else:
             return None
 
+class IngredientIndex:
+    # Posting lists from every distinct ingredient (lower-cased) to the sorted
+    # positions of the rows using it
+    def __init__(self,vocabulary,postings,n_rows,cache_size=4096):
+        self.vocabulary=vocabulary
+        self.postings=postings
+        self.n_rows=n_rows
+        self.cache_size=cache_size
+        self._term_rows={}
+
+    @classmethod
+    def from_parts(cls,ingredient_parts):
+        postings={}
+        for row,parts in enumerate(ingredient_parts):
+            for part in set(parts):
+                postings.setdefault(part.lower(),[]).append(row)
+        return cls(list(postings),[np.array(rows,dtype=np.int64) for rows in postings.values()],len(ingredient_parts))
+
+    @classmethod
+    def from_dataframe(cls,dataframe):
+        column=dataframe['RecipeIngredientParts']
+        return cls.from_parts([extract_quoted_strings(s) if isinstance(s,str) else [] for s in column])
+
+    def extended(self,ingredient_parts):
+        # New index with rows appended after the existing ones, the posting
+        # lists of untouched ingredients are shared with this index
+        vocabulary=list(self.vocabulary)
+        postings=list(self.postings)
+        positions={word:i for i,word in enumerate(vocabulary)}
+        added={}
+        for row,parts in enumerate(ingredient_parts,start=self.n_rows):
+            for part in set(parts):
+                added.setdefault(part.lower(),[]).append(row)
+        for word,rows in added.items():
+            if word in positions:
+                postings[positions[word]]=np.concatenate([postings[positions[word]],rows]).astype(np.int64)
+            else:
+                vocabulary.append(word)
+                postings.append(np.array(rows,dtype=np.int64))
+        return IngredientIndex(vocabulary,postings,self.n_rows+len(ingredient_parts),self.cache_size)
+
+    def term_rows(self,term):
+        # Same case insensitive substring match as the old regex, but run over
+        # the vocabulary instead of every row
+        term=term.lower()
+        rows=self._term_rows.get(term)
+        if rows is None:
+            matches=[postings for word,postings in zip(self.vocabulary,self.postings) if term in word]
+            rows=np.unique(np.concatenate(matches)) if matches else np.empty(0,dtype=np.int64)
+            if len(self._term_rows)>=self.cache_size:
+                self._term_rows.clear()
+            self._term_rows[term]=rows
+        return rows
+
+    def lookup(self,ingredients):
+        # Rows containing all the ingredients, smallest posting list first
+        terms=[ingredient.strip() for ingredient in ingredients if ingredient.strip()]
+        if not terms:
+            return np.arange(self.n_rows)
+        postings=sorted((self.term_rows(term) for term in terms),key=len)
+        rows=postings[0]
+        for other in postings[1:]:
+            if rows.size==0:
+                break
+            rows=np.intersect1d(rows,other,assume_unique=True)
+        return rows
+
+class AppendedRecords:
+    # Records of the loaded dataset followed by the recipes appended at runtime
+    def __init__(self,base,appended):
+        self.base=base
+        self.appended=appended
+
+    @classmethod
+    def extend(cls,records,recipes):
+        if isinstance(records,cls):
+            return cls(records.base,records.appended+list(recipes))
+        return cls(records,list(recipes))
+
+    def __getitem__(self,row):
+        n_base=len(self.base)
+        return self.base[row] if row<n_base else self.appended[row-n_base]
+
+    def __len__(self):
+        return len(self.base)+len(self.appended)
+
+class DuplicateRecipe(ValueError):
+    # An appended recipe whose RecipeId is already served
+    pass
+
+class AppendedRows:
+    # Rows of a loaded array (e.g. memory-mapped) followed by the rows appended
+    # at runtime, read by position like the array. Appending only copies the
+    # appended rows, the loaded array stays shared
+    def __init__(self,base,appended):
+        self.base=base
+        self.appended=appended
+
+    @classmethod
+    def extend(cls,rows,new_rows):
+        if isinstance(rows,cls):
+            return cls(rows.base,np.concatenate([rows.appended,new_rows]))
+        return cls(rows,new_rows)
+
+    @property
+    def shape(self):
+        return (self.base.shape[0]+self.appended.shape[0],)+self.base.shape[1:]
+
+    def __getitem__(self,rows):
+        rows=np.asarray(rows)
+        n_base=self.base.shape[0]
+        in_base=rows<n_base
+        found=np.empty(rows.shape+self.base.shape[1:],dtype=self.appended.dtype)
+        found[in_base]=self.base[rows[in_base]]
+        found[~in_base]=self.appended[rows[~in_base]-n_base]
+        return found
+
+class RecipeIndex:
+    # Scaler, scaled matrix and neighbour structure fitted once over the whole
+    # dataset, so that a request only has to run the query.
+    #
+    # subset_scaling decides how ingredient filtered requests are scaled:
+    #   True  -> standardize the matching rows with their own mean/std, which
+    #            gives the same neighbours as fitting a scaler on the subset
+    #   False -> reuse the global scaler and the precomputed scaled matrix
+    #
+    # engine picks the neighbour search used for unfiltered requests, see ann.py
+    #
+    # records can be any sequence of recipe dicts indexed by row position, such
+    # as the list built by parse_records() or an artifact.TextStore.
+    #
+    # The scaled matrix is stored in float32 with its inverse row norms. A fitted
+    # scaler, scaled matrix and engine can be passed in, e.g. loaded from the
+    # memory-mapped files shared between workers, see artifact.py.
+    #
+    # version identifies the data served, results cached for another version
+    # are not reused.
+    #
+    # An index is never modified once built: appended() and retired() return a
+    # new one, which is swapped in while running requests finish on the old one.
+    # Retired rows stay in the arrays and are masked out by active. Appended
+    # rows are scaled with the scaler fitted at load time and kept after the
+    # loaded arrays (see AppendedRows), the engine only holds the loaded rows:
+    # nothing is rescaled and the memory-mapped arrays stay shared. The scaler
+    # statistics are those of the loaded dataset until it is rebuilt.
+    def __init__(self,features,records,ingredient_index,subset_scaling=True,engine='brute',engine_options=None,
+                 scaler=None,prep_data=None,inv_norms=None,neigh=None,active=None,version=0):
+        self.version=version
+        self.active=active
+        self.n_retired=0 if active is None else int(active.shape[0]-np.count_nonzero(active))
+        self.features=features
+        self.records=records
+        self.ingredient_index=ingredient_index
+        self.subset_scaling=subset_scaling
+        if scaler is None:
+            scaler=StandardScaler()
+            prep_data=scaler.fit_transform(np.asarray(features,dtype=np.float64)).astype(np.float32)
+        self.scaler=scaler
+        self.prep_data=prep_data
+        self.inv_norms=inv_norms if inv_norms is not None else inverse_norms(prep_data)
+        self.neigh=neigh if neigh is not None else make_engine(engine,self.prep_data,**(engine_options or {}))
+        # Rows held by the engine, the ones after them were appended
+        self.n_indexed=self.n_rows
+        # JSON fragments of the recipes served recently, by row
+        self.fragments={}
+        self.fragment_cache_size=65536
+
+    @classmethod
+    def from_dataframe(cls,dataframe,**options):
+        return cls(
+            dataframe.iloc[:,6:15].to_numpy(dtype=np.float64),
+            parse_records(dataframe),
+            IngredientIndex.from_dataframe(dataframe),
+            **options,
+        )
+
+    @property
+    def n_rows(self):
+        return self.features.shape[0]
+
+    @property
+    def n_active(self):
+        return self.n_rows-self.n_retired
+
+    def active_rows(self,rows):
+        return rows if self.active is None else rows[self.active[rows]]
+
+    def unit_rows(self,rows):
+        # Scaled rows normalized to unit length, for similarities between recipes
+        return np.asarray(self.prep_data[rows],dtype=np.float32)*self.inv_norms[rows][:,np.newaxis]
+
+    def recipe_rows(self):
+        # RecipeId to row position of the active recipes, built on first use
+        if getattr(self,'_recipe_rows',None) is None:
+            self._recipe_rows={self.records[row].get('RecipeId'):row for row in self.active_rows(np.arange(self.n_rows))}
+        return self._recipe_rows
+
+    def with_version(self,version):
+        # Copy of the index serving the same data under another version, the
+        # arrays and caches are shared
+        index=copy.copy(self)
+        index.version=version
+        return index
+
+    def with_rows(self,**changes):
+        # Copy of the index with other rows or records, the encoded recipes
+        # stay valid as rows keep their recipe
+        index=copy.copy(self)
+        index.__dict__.update(changes)
+        index.n_retired=0 if index.active is None else int(index.active.shape[0]-np.count_nonzero(index.active))
+        return index
+
+    def appended(self,recipes):
+        # New index with the recipes (dicts shaped like the records) added.
+        # Raises ValueError for a recipe without a RecipeId or with a nutrition
+        # value that is not finite, DuplicateRecipe for a RecipeId served or
+        # given twice
+        recipes=list(recipes)
+        if not recipes:
+            return self
+        recipe_ids=[recipe.get('RecipeId') for recipe in recipes]
+        if None in recipe_ids:
+            raise ValueError("Appended recipes need a RecipeId")
+        recipe_rows=self.recipe_rows()
+        counts=Counter(recipe_ids)
+        duplicates=sorted(recipe_id for recipe_id,count in counts.items() if count>1 or recipe_id in recipe_rows)
+        if duplicates:
+            raise DuplicateRecipe(f"RecipeIds already served or given twice: {duplicates}")
+        new_features=np.array([[recipe[column] for column in NUTRITION_COLUMNS] for recipe in recipes],dtype=np.float64)
+        if not np.isfinite(new_features).all():
+            raise ValueError("Nutrition values must be finite")
+        new_prep_data=self.scaler.transform(new_features).astype(np.float32)
+        index=self.with_rows(
+            features=AppendedRows.extend(self.features,new_features),
+            records=AppendedRecords.extend(self.records,recipes),
+            ingredient_index=self.ingredient_index.extended([recipe['RecipeIngredientParts'] for recipe in recipes]),
+            prep_data=AppendedRows.extend(self.prep_data,new_prep_data),
+            inv_norms=AppendedRows.extend(self.inv_norms,inverse_norms(new_prep_data)),
+            active=None if self.active is None else np.concatenate([self.active,np.ones(len(recipes),dtype=bool)]),
+        )
+        index._recipe_rows=dict(recipe_rows)
+        index._recipe_rows.update(zip(recipe_ids,range(self.n_rows,self.n_rows+len(recipes))))
+        return index
+
+    def retired(self,recipe_ids):
+        # New index without the recipes with these RecipeIds, unknown ids are ignored
+        recipe_rows=self.recipe_rows()
+        rows=np.array(sorted({recipe_rows[recipe_id] for recipe_id in recipe_ids if recipe_id in recipe_rows}),dtype=np.int64)
+        if rows.shape[0]==0:
+            return self
+        active=np.ones(self.n_rows,dtype=bool) if self.active is None else self.active.copy()
+        active[rows]=False
+        index=self.with_rows(active=active)
+        index._recipe_rows={recipe_id:row for recipe_id,row in recipe_rows.items() if active[row]}
+        return index
+
+    def kneighbors(self,_input,n_neighbors=5,trace=NULL_TRACE):
+        # Unfiltered search through the engine. Once recipes were appended or
+        # retired, the engine is asked for extra candidates to skip the retired
+        # rows, the appended rows are added to them and they are all re-scored
+        queries=self.scaler.transform(np.array(_input,dtype=np.float64).reshape(-1,self.features.shape[1]))
+        trace.lap('scale')
+        if self.n_retired==0 and self.n_indexed==self.n_rows:
+            found=self.neigh.kneighbors(queries,n_neighbors=n_neighbors)
+            trace.lap('knn')
+            return found
+        candidates=self.neigh.kneighbors(queries,n_neighbors=min(n_neighbors+self.n_retired,self.n_indexed),return_distance=False)
+        appended_rows=np.arange(self.n_indexed,self.n_rows)
+        normalized=normalize_rows(queries).astype(np.float32)
+        distances=np.empty((queries.shape[0],n_neighbors))
+        found=np.empty((queries.shape[0],n_neighbors),dtype=np.int64)
+        for line,rows in enumerate(candidates):
+            rows=self.active_rows(np.concatenate([rows[rows<self.n_indexed],appended_rows]))
+            if rows.shape[0]<n_neighbors:
+                rows=self.active_rows(np.arange(self.n_rows))
+            similarities,found[line]=cosine_top_k(normalized[line:line+1],self.prep_data[rows],self.inv_norms[rows],rows,n_neighbors)
+            distances[line]=1.0-similarities[0]
+        trace.lap('knn')
+        return distances,found
+
+    def masked_kneighbors(self,_input,rows,n_neighbors=5,trace=NULL_TRACE):
+        # Exact cosine search restricted to a boolean row mask or row positions,
+        # for one input or a batch of inputs (one per line of the result).
+        # Ties are broken by row position so results are deterministic.
+        # Returns the cosine distances and the row positions, nearest first.
+        rows=np.asarray(rows)
+        if rows.dtype==bool:
+            rows=np.flatnonzero(rows)
+        _input=np.array(_input,dtype=np.float64).reshape(-1,self.features.shape[1])
+        if self.subset_scaling:
+            features=np.asarray(self.features[rows],dtype=np.float64)
+            mean=features.mean(axis=0)
+            scale=features.std(axis=0)
+            scale[scale==0]=1.0
+            data=((features-mean)/scale).astype(np.float32)
+            inv_norms=inverse_norms(data)
+            query=(_input-mean)/scale
+        else:
+            data=self.prep_data[rows]
+            inv_norms=self.inv_norms[rows]
+            query=self.scaler.transform(_input)
+        query=normalize_rows(query).astype(np.float32)
+        trace.lap('scale')
+        similarities,found=cosine_top_k(query,data,inv_norms,rows,n_neighbors)
+        trace.lap('knn')
+        return 1.0-similarities.astype(np.float64),found
+
+    def n_matching(self,ingredients):
+        # Active recipes a search with these ingredients can return
+        if ingredients:
+            return self.active_rows(self.ingredient_index.lookup(ingredients)).shape[0]
+        return self.n_active
+
+    def search(self,_input,ingredients=[],params={'n_neighbors':5,'return_distance':False},trace=NULL_TRACE):
+        # Distances and row positions of the recommended recipes, None when
+        # too few recipes match. The stages are timed on trace (see metrics.py)
+        if ingredients:
+            rows=self.active_rows(self.ingredient_index.lookup(ingredients))
+            trace.lap('filter')
+            trace.size('filtered_rows',rows.shape[0])
+            if rows.shape[0]>=params['n_neighbors']:
+                distances,rows=self.masked_kneighbors(_input,rows,params['n_neighbors'],trace)
+                return distances[0],rows[0]
+            else:
+                return None
+        if self.n_active>=params['n_neighbors']:
+            distances,rows=self.kneighbors(_input,params['n_neighbors'],trace)
+            return distances[0],rows[0]
+        else:
+            return None
+
+    def search_batch(self,inputs,ingredients_list,params_list):
+        # Answers many requests at once: all unfiltered inputs go through a
+        # single kneighbors call, filtered inputs are grouped by ingredient set
+        # so each set is looked up and searched once
+        groups={}
+        for i,ingredients in enumerate(ingredients_list):
+            key=tuple(sorted({ingredient.strip().lower() for ingredient in ingredients if ingredient.strip()}))
+            groups.setdefault(key,[]).append(i)
+        results=[None]*len(inputs)
+        for key,items in groups.items():
+            queries=np.array([inputs[i] for i in items],dtype=np.float64)
+            n_neighbors=max(params_list[i]['n_neighbors'] for i in items)
+            if key:
+                rows=self.active_rows(self.ingredient_index.lookup(key))
+                n_neighbors=min(n_neighbors,rows.shape[0])
+                if n_neighbors==0:
+                    continue
+                distances,found=self.masked_kneighbors(queries,rows,n_neighbors)
+            else:
+                n_neighbors=min(n_neighbors,self.n_active)
+                distances,found=self.kneighbors(queries,n_neighbors)
+            for line,i in enumerate(items):
+                k=params_list[i]['n_neighbors']
+                if found.shape[1]>=k:
+                    results[i]=(distances[line,:k],found[line,:k])
+        return results
+
+    def output_recommended_recipes(self,rows):
+        # Same output as output_recommended_recipes() on the matching rows, but
+        # looked up from the records parsed at load time. The records are shared
+        # between requests and must not be modified.
+        return None if rows is None else [self.records[row] for row in rows]
+
+    def prediction_json(self,found,return_distance=False):
+        # /predict/ response body spliced from the encoded recipes, the same
+        # document as PredictionOut without its None fields
+        if found is None:
+            return b'{"output":[]}'
+        distances,rows=found
+        body=b'{"output":'+self.recipes_json(rows)
+        if return_distance:
+            body+=b',"distances":'+dumps(distances.tolist())
+        return body+b'}'
+
+    def recipes_json(self,rows):
+        return b'['+b','.join(self.recipe_json(row) for row in rows)+b']'
+
+    def recipe_json(self,row):
+        # The recipe of a row encoded as a JSON object of RECIPE_FIELDS, kept
+        # for the next responses. The cache starts over once full
+        fragment=self.fragments.get(row)
+        if fragment is None:
+            if len(self.fragments)>=self.fragment_cache_size:
+                self.fragments.clear()
+            fragment=self.fragments[row]=encode_recipe(self.records[row])
+        return fragment
+
 def extract_quoted_strings(s):
     # Find all the strings inside double quotes
     strings = re.findall(r'"([^"]*)"', s)
     # Join the strings with 'and'
     return strings
 
+def parse_records(dataframe):
+    # One dict per row with the ingredients and instructions already split
+    records=dataframe.to_dict("records")
+    for recipe in records:
+        for column in ('RecipeIngredientParts','RecipeInstructions'):
+            recipe[column]=extract_quoted_strings(recipe[column]) if isinstance(recipe[column],str) else []
+    return records
+
 def output_recommended_recipes(dataframe):
     if dataframe is not None:
         output=dataframe.copy()
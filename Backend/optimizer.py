@@ -0,0 +1,136 @@
+import time
+import numpy as np
+
+# Choice of one recipe per meal so that the day totals land closest to the
+# calorie target, while keeping the other nutrients within optional bounds.
+#
+# A combination scores its relative calorie error plus the relative amount by
+# which each bounded nutrient leaves its bounds, times penalty. Up to
+# max_combinations, the Cartesian product is searched exhaustively: the meals
+# are split in two halves whose partial totals are enumerated once, and blocks
+# of the first half are added to the part of the second half that can still
+# improve on the best combinations found so far.
+# Larger products go through a beam search keeping the beam_width best partial
+# plans, each completed with the mean candidate of the meals still to choose.
+
+
+class CombinationScorer:
+    def __init__(self,target_calories,lower,upper,penalty=1.0):
+        # lower and upper hold the day bounds of every nutrient column, -inf or
+        # inf when unbounded. Column 0 is Calories, only it and the bounded
+        # columns are summed
+        self.target=float(target_calories)
+        self.penalty=penalty
+        self.columns=np.union1d([0],np.flatnonzero(np.isfinite(lower)|np.isfinite(upper)))
+        self.lower=lower[self.columns].astype(np.float32)
+        self.upper=upper[self.columns].astype(np.float32)
+        self.norms=np.maximum(np.where(np.isfinite(self.upper),np.abs(self.upper),np.abs(self.lower)),1.0)
+        self.norms[~np.isfinite(self.norms)]=1.0
+        self.checked=bool(np.isfinite(self.lower).any() or np.isfinite(self.upper).any())
+
+    def __call__(self,totals):
+        # totals: (..., len(columns)) partial or complete day totals
+        scores=np.abs(totals[...,0]-self.target)/max(self.target,1.0)
+        if self.checked:
+            violations=np.maximum(self.lower-totals,0)+np.maximum(totals-self.upper,0)
+            scores=scores+self.penalty*(violations/self.norms).sum(axis=-1)
+        return scores
+
+def best_of(scores,n):
+    n=min(n,scores.shape[0])
+    best=np.argpartition(scores,n-1)[:n]
+    return best[np.lexsort((best,scores[best]))]
+
+def combination_totals(candidates,n_columns):
+    # Totals of every combination of the meals, in C order of the meal choices.
+    # No meals make a single combination totalling zero
+    totals=np.zeros((1,n_columns),dtype=np.float32)
+    for meal in candidates:
+        totals=(totals[:,np.newaxis,:]+meal[np.newaxis,:,:]).reshape(-1,meal.shape[1])
+    return totals
+
+def exhaustive_search(candidates,scorer,n,deadline=None,block_elements=1_000_000):
+    sizes=[meal.shape[0] for meal in candidates]
+    # Split point balancing the two halves of the product
+    split=min(range(len(sizes)+1),key=lambda i:abs(np.log(np.prod(sizes[:i],dtype=np.float64))-np.log(np.prod(sizes[i:],dtype=np.float64))))
+    head=combination_totals(candidates[:split],candidates[0].shape[1])
+    tail=combination_totals(candidates[split:],candidates[0].shape[1])
+    # The second half sorted by calories: once n combinations are known, a
+    # combination can only beat them if its calorie error alone is below their
+    # worst score, which bounds every row of the first half to a contiguous
+    # range of the second
+    order=np.argsort(tail[:,0],kind='stable')
+    tail=tail[order]
+    scale=max(scorer.target,1.0)
+    block=max(1,block_elements//(tail.shape[0]*tail.shape[1]))
+    best_scores=np.empty(0,dtype=np.float64)
+    best_flat=np.empty(0,dtype=np.int64)
+    start=0
+    while start<head.shape[0]:
+        if best_scores.shape[0]<n:
+            # Just enough rows to have n combinations to bound the rest with
+            partial=head[start:start+max(1,-(-n//tail.shape[0]))]
+            rows=np.repeat(np.arange(partial.shape[0]),tail.shape[0])
+            columns=np.tile(np.arange(tail.shape[0]),partial.shape[0])
+        else:
+            partial=head[start:start+block]
+            margin=best_scores[-1]*scale*(1+1e-6)+1e-3
+            low=np.searchsorted(tail[:,0],scorer.target-margin-partial[:,0],side='left')
+            high=np.searchsorted(tail[:,0],scorer.target+margin-partial[:,0],side='right')
+            counts=high-low
+            rows=np.repeat(np.arange(partial.shape[0]),counts)
+            columns=np.arange(rows.shape[0])-np.repeat(np.cumsum(counts)-counts-low,counts)
+        if 2*rows.shape[0]>partial.shape[0]*tail.shape[0]:
+            # Little to prune, broadcasting beats gathering the pairs
+            scores=scorer(partial[:,np.newaxis,:]+tail[np.newaxis,:,:]).ravel()
+            rows,columns=np.divmod(np.arange(scores.shape[0]),tail.shape[0])
+        elif rows.shape[0]:
+            scores=scorer(partial[rows]+tail[columns])
+        if rows.shape[0]:
+            top=best_of(scores,n)
+            best_scores=np.concatenate([best_scores,scores[top]])
+            best_flat=np.concatenate([best_flat,(start+rows[top])*tail.shape[0]+order[columns[top]]])
+            keep=best_of(best_scores,n)
+            best_scores,best_flat=best_scores[keep],best_flat[keep]
+        start+=partial.shape[0]
+        if deadline is not None and time.perf_counter()>deadline:
+            break
+    return np.stack(np.unravel_index(best_flat,sizes),axis=1)
+
+def beam_search(candidates,scorer,n,beam_width=512):
+    # Remaining meals are estimated by their mean candidate
+    means=[meal.mean(axis=0) for meal in candidates]
+    rest=np.cumsum([np.zeros_like(means[0])]+means[::-1],axis=0)[::-1]
+    choices=np.zeros((1,0),dtype=np.int64)
+    totals=np.zeros((1,candidates[0].shape[1]),dtype=np.float32)
+    for i,meal in enumerate(candidates):
+        totals=(totals[:,np.newaxis,:]+meal[np.newaxis,:,:]).reshape(-1,meal.shape[1])
+        choices=np.hstack([np.repeat(choices,meal.shape[0],axis=0),np.tile(np.arange(meal.shape[0]),choices.shape[0])[:,np.newaxis]])
+        keep=best_of(scorer(totals+rest[i+1]),max(beam_width,n))
+        totals,choices=totals[keep],choices[keep]
+    return choices[best_of(scorer(totals),n)]
+
+def best_combinations(candidates,target_calories,lower=None,upper=None,n=1,penalty=1.0,
+                      max_combinations=4_000_000,beam_width=512,budget=None):
+    # candidates: one (k_i, n_nutrients) array per meal, lower and upper the
+    # day bounds per nutrient (NaN when unbounded). Returns up to n
+    # (choices, totals, score), choices holding the candidate row of each meal
+    candidates=[np.asarray(meal,dtype=np.float64) for meal in candidates]
+    if n<1 or not candidates or any(meal.shape[0]==0 for meal in candidates):
+        return []
+    n_columns=candidates[0].shape[1]
+    lower=np.full(n_columns,-np.inf) if lower is None else np.nan_to_num(np.asarray(lower,dtype=np.float64),nan=-np.inf)
+    upper=np.full(n_columns,np.inf) if upper is None else np.nan_to_num(np.asarray(upper,dtype=np.float64),nan=np.inf)
+    scorer=CombinationScorer(target_calories,lower,upper,penalty)
+    columns=scorer.columns
+    summed=[meal[:,columns].astype(np.float32) for meal in candidates]
+    if np.prod([meal.shape[0] for meal in candidates],dtype=np.float64)<=max_combinations:
+        deadline=None if budget is None else time.perf_counter()+budget
+        choices=exhaustive_search(summed,scorer,n,deadline)
+    else:
+        choices=beam_search(summed,scorer,n,beam_width)
+    results=[]
+    for choice in choices:
+        totals=sum(meal[row] for meal,row in zip(candidates,choice))
+        results.append((choice.tolist(),totals,float(scorer(totals[columns][np.newaxis])[0])))
+    return sorted(results,key=lambda result:result[2])
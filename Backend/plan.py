@@ -0,0 +1,77 @@
+import random
+import numpy as np
+
+# Daily calorie needs and per meal nutrition targets, as computed by the
+# automatic diet page, so a whole day is planned in one request
+
+ACTIVITY_LEVELS={
+    'Little/no exercise':1.2,
+    'Light exercise':1.375,
+    'Moderate exercise (3-5 days/wk)':1.55,
+    'Very active (6-7 days/wk)':1.725,
+    'Extra active (very active & physical job)':1.9,
+}
+
+PLANS={
+    'Maintain weight':1,
+    'Mild weight loss':0.9,
+    'Weight loss':0.8,
+    'Extreme weight loss':0.6,
+}
+
+# Share of the daily calories of each meal
+MEAL_SPLITS={
+    3:{'breakfast':0.35,'lunch':0.40,'dinner':0.25},
+    4:{'breakfast':0.30,'morning snack':0.05,'lunch':0.40,'dinner':0.25},
+    5:{'breakfast':0.30,'morning snack':0.05,'lunch':0.40,'afternoon snack':0.05,'dinner':0.20},
+}
+
+# Ranges the other nutrition targets of a meal are drawn from: fat, saturated
+# fat, cholesterol, sodium, carbohydrate, fiber, sugar and protein
+LIGHT_MEAL=[(10,30),(0,4),(0,30),(0,400),(40,75),(4,10),(0,10),(30,100)]
+MAIN_MEAL=[(20,40),(0,4),(0,30),(0,400),(40,75),(4,20),(0,10),(50,175)]
+MEAL_RANGES={'lunch':MAIN_MEAL,'dinner':MAIN_MEAL}
+
+def calculate_bmr(age,height,weight,gender):
+    # Mifflin-St Jeor
+    if gender=='Male':
+        return 10*weight+6.25*height-5*age+5
+    return 10*weight+6.25*height-5*age-161
+
+def calories_calculator(age,height,weight,gender,activity):
+    return calculate_bmr(age,height,weight,gender)*ACTIVITY_LEVELS[activity]
+
+def meal_targets(total_calories,meals_per_day,rng=random):
+    # (meal, nutrition_input) for each meal of the day
+    targets=[]
+    for meal,share in MEAL_SPLITS[meals_per_day].items():
+        ranges=MEAL_RANGES.get(meal,LIGHT_MEAL)
+        targets.append((meal,[int(share*total_calories)]+[int(rng.uniform(low,high)) for low,high in ranges]))
+    return targets
+
+def diversified(relevance,vectors,n_days,n_per_day,diversity=0.3):
+    # Shares a pool of candidates between the days with maximal marginal
+    # relevance: the days pick in turn the candidate maximizing
+    #   (1-diversity)*relevance - diversity*max similarity to the picks so far
+    # over precomputed unit vectors. A candidate is used once until the pool
+    # runs out, and never twice the same day
+    n_candidates=relevance.shape[0]
+    similarities=vectors@vectors.T
+    closest=np.zeros(n_candidates)
+    used=np.zeros(n_candidates,dtype=bool)
+    days=[[] for _ in range(n_days)]
+    for _ in range(min(n_per_day,n_candidates)):
+        for picks in days:
+            if used.all():
+                used[:]=False
+            scores=(1-diversity)*relevance-diversity*closest
+            scores[used]=-np.inf
+            scores[picks]=-np.inf
+            if not np.isfinite(scores).any():
+                scores=(1-diversity)*relevance-diversity*closest
+                scores[picks]=-np.inf
+            pick=int(np.argmax(scores))
+            picks.append(pick)
+            used[pick]=True
+            closest=np.maximum(closest,similarities[pick])
+    return days
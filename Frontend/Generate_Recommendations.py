@@ -1,5 +1,90 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class RecommenderClient:
+    # HTTP client of the recommendation backend shared by every page and
+    # session of the Streamlit server process: the connections are kept alive
+    # in a pool of pool_size, every request has a (connect, read) timeout and
+    # failed connections and 502/503/504 answers are retried with backoff
+    # (the backend endpoints only read, retrying them is safe). A read timeout
+    # is not retried, the backend is still busy with the request.
+    #
+    # The async variants run the same pooled requests on a thread pool, so they
+    # work from the event loop asyncio.run() creates on every script run.
+    def __init__(self,base_url:str,timeout:tuple=(3.05,30),retries:int=2,pool_size:int=16):
+        self.base_url=base_url.rstrip('/')
+        self.timeout=timeout
+        self.session=requests.Session()
+        retry=Retry(
+            total=retries,
+            read=False,
+            backoff_factor=0.3,
+            status_forcelist=(502,503,504),
+            allowed_methods=None,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter=HTTPAdapter(pool_connections=1,pool_maxsize=pool_size,max_retries=retry)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+        self.pool=ThreadPoolExecutor(pool_size,thread_name_prefix='recommender')
+
+    def post(self,path:str,payload)->requests.Response:
+        return self.session.post(self.base_url+path,json=payload,timeout=self.timeout)
+
+    def predict(self,payload:dict)->requests.Response:
+        return self.post('/predict/',payload)
+
+    def predict_batch(self,payloads:list)->requests.Response:
+        # Every payload answered by one request to /predict/batch
+        return self.post('/predict/batch',payloads)
+
+    def plan_day(self,profile:dict)->requests.Response:
+        return self.post('/plan/day',profile)
+
+    def predict_many(self,payloads:list,return_exceptions:bool=False)->list:
+        # One /predict/ request per payload, sent concurrently. With
+        # return_exceptions the exception of a failed request takes its place
+        # in the results instead of being raised
+        futures=[self.pool.submit(self.predict,payload) for payload in payloads]
+        results=[]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    async def apost(self,path:str,payload)->requests.Response:
+        return await asyncio.get_running_loop().run_in_executor(self.pool,partial(self.post,path,payload))
+
+    async def apredict(self,payload:dict)->requests.Response:
+        return await self.apost('/predict/',payload)
+
+    async def apredict_batch(self,payloads:list)->requests.Response:
+        return await self.apost('/predict/batch',payloads)
+
+    async def aplan_day(self,profile:dict)->requests.Response:
+        return await self.apost('/plan/day',profile)
+
+    async def apredict_many(self,payloads:list,return_exceptions:bool=False)->list:
+        return await asyncio.gather(*(self.apredict(payload) for payload in payloads),return_exceptions=return_exceptions)
+
+# Shared client, configured by RECOMMENDER_URL, RECOMMENDER_CONNECT_TIMEOUT,
+# RECOMMENDER_READ_TIMEOUT (seconds), RECOMMENDER_RETRIES and RECOMMENDER_POOL_SIZE
+client=RecommenderClient(
+    os.getenv('RECOMMENDER_URL','http://127.0.0.1:8000'),
+    timeout=(float(os.getenv('RECOMMENDER_CONNECT_TIMEOUT','3.05')),float(os.getenv('RECOMMENDER_READ_TIMEOUT','30'))),
+    retries=int(os.getenv('RECOMMENDER_RETRIES','2')),
+    pool_size=int(os.getenv('RECOMMENDER_POOL_SIZE','16')),
+)
 
 class Generator:
     def __init__(self,nutrition_input:list,ingredients:list=[],params:dict={'n_neighbors':5,'return_distance':False}):
@@ -12,26 +97,22 @@ class Generator:
         self.ingredients=ingredients
         self.params=params
 
-    def generate(self,):
+    def request(self,):
+        # The backend takes the ingredients as one semicolon separated string
         request={
             'nutrition_input':self.nutrition_input,
-            'ingredients':self.ingredients,
             'params':self.params
         }
-        response=requests.post(url='http://127.0.0.1:8000/predict/',data=json.dumps(request))
-        print(response)
-        return response
-    
-    def generato(self,):
-        request={
-            'nutrition_input':self.nutrition_input,
-            'params':self.params
+        ingredients=[ingredient for ingredient in self.ingredients if ingredient.strip()]
+        if ingredients:
+            request['ingredients']=';'.join(ingredients)
+        return request
 
-        }
-        response=requests.post(url='http://127.0.0.1:8000/predict/',data=json.dumps(request))
-        print(response)
-        return response
+    def generate(self,):
+        return client.predict(self.request())
 
+    def generato(self,):
+        return client.predict({'nutrition_input':self.nutrition_input,'params':self.params})
 
-    
-    
\ No newline at end of file
+    async def agenerate(self,):
+        return await client.apredict(self.request())
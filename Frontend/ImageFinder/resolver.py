@@ -0,0 +1,141 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Image links of the recipes, looked up by a provider and kept in an on-disk
+# cache so that a recipe is searched once, not on every page run.
+#
+# A provider is a callable (session, recipe_name, timeout) returning the image
+# link of the recipe, or None when the search found nothing. It raises when the
+# search failed (network error, timeout): failures are not cached and the next
+# page run tries again, while "nothing found" is cached for negative_ttl.
+#
+# Lookups run on a pool of max_workers threads sharing one requests session,
+# whose connection pool is bounded to the same size. A recipe being looked up
+# is searched once even when several pages ask for it at the same time.
+
+
+class ImageCache:
+    # Recipe name -> image link (or None when nothing was found), in SQLite
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, negative_ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, link TEXT, expires REAL)")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(recipe_name: str):
+        return " ".join(recipe_name.lower().split())
+
+    def get(self, recipe_name: str):
+        # (found, link): found is False when the name is not cached or expired
+        with self._lock:
+            row = self._connection.execute("SELECT link, expires FROM images WHERE name = ?", (self.key(recipe_name),)).fetchone()
+        if row is None or row[1] < time.time():
+            return False, None
+        return True, row[0]
+
+    def get_many(self, recipe_names: list):
+        keys = {self.key(name): name for name in recipe_names}
+        found = {}
+        now = time.time()
+        names = list(keys)
+        with self._lock:
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT name, link, expires FROM images WHERE name IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, link, expires in rows:
+                    if expires >= now:
+                        found[keys[key]] = link
+        return found
+
+    def put(self, recipe_name: str, link):
+        expires = time.time() + (self.ttl if link else self.negative_ttl)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images (name, link, expires) VALUES (?, ?, ?)", (self.key(recipe_name), link, expires)
+            )
+
+    def purge(self):
+        # Drops the expired entries
+        with self._lock:
+            self._connection.execute("DELETE FROM images WHERE expires < ?", (time.time(),))
+
+
+def static_provider(links: dict, default=None):
+    # Provider answering from a dict, a local stand-in for tests and offline runs
+    def provider(session, recipe_name, timeout):
+        return links.get(recipe_name, default)
+    return provider
+
+
+class ImageResolver:
+    def __init__(self, provider, cache: ImageCache = None, max_workers: int = 8, timeout: float = 5.0, not_found: str = None):
+        self.provider = provider
+        self.cache = cache
+        self.timeout = timeout
+        self.not_found = not_found
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="image")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, recipe_name: str):
+        try:
+            link = self.provider(self.session, recipe_name, self.timeout)
+        except Exception as e:
+            logging.getLogger(__name__).warning("Image lookup of %r failed: %s", recipe_name, e)
+            return None
+        if self.cache is not None:
+            self.cache.put(recipe_name, link)
+        return link
+
+    def submit(self, recipe_name: str) -> Future:
+        # Future of the image link, shared by everyone asking for the same
+        # recipe while its lookup runs
+        with self._lock:
+            future = self._pending.get(recipe_name)
+            if future is None:
+                future = self._pending[recipe_name] = self.pool.submit(self.lookup, recipe_name)
+                future.add_done_callback(lambda _: self._forget(recipe_name))
+            return future
+
+    def _forget(self, recipe_name: str):
+        with self._lock:
+            self._pending.pop(recipe_name, None)
+
+    def resolve_many(self, recipe_names: list, timeout: float = None) -> dict:
+        # Image link of every recipe, not_found for the ones without a link or
+        # whose lookup failed or did not finish within timeout seconds (the
+        # lookup still completes and fills the cache)
+        names = list(dict.fromkeys(recipe_names))
+        links = self.cache.get_many(names) if self.cache is not None else {}
+        futures = {name: self.submit(name) for name in names if name not in links}
+        if futures:
+            wait(futures.values(), timeout=self.timeout + 1 if timeout is None else timeout)
+        for name, future in futures.items():
+            links[name] = future.result() if future.done() and not future.cancelled() else None
+        return {name: links[name] or self.not_found for name in names}
+
+    def resolve(self, recipe_name: str, timeout: float = None) -> str:
+        return self.resolve_many([recipe_name], timeout)[recipe_name]
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
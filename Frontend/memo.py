@@ -0,0 +1,72 @@
+import asyncio
+import os
+from functools import cache
+import streamlit as st
+from Generate_Recommendations import client
+from ImageFinder.ImageFinder import Not_found_link, find_images
+
+# Results of the backend and of the image finder memoized by st.cache_data, so
+# that the reruns of a page and the sessions of every user of the Streamlit
+# server share them: a profile or a request asked for before is answered
+# without calling the backend, a recipe image is looked up once.
+#
+# The recommendations are keyed on the request payload (/predict/) or profile
+# (/plan/day) and the images on the recipe name. Entries expire after a TTL and
+# the least recently used ones are dropped past a number of entries, configured
+# by FRONTEND_CACHE_TTL (seconds), FRONTEND_CACHE_ENTRIES, FRONTEND_IMAGE_CACHE_TTL
+# and FRONTEND_IMAGE_CACHE_ENTRIES. Errors raise out of the memoized functions,
+# so a failed request is never cached and is sent again by the next run.
+#
+# st.cache_data hands every caller its own copy of the result, adding image
+# links to the recipes returned does not change the cached ones.
+
+CACHE_TTL=float(os.getenv('FRONTEND_CACHE_TTL','600'))
+CACHE_ENTRIES=int(os.getenv('FRONTEND_CACHE_ENTRIES','1000'))
+IMAGE_CACHE_TTL=float(os.getenv('FRONTEND_IMAGE_CACHE_TTL','86400'))
+IMAGE_CACHE_ENTRIES=int(os.getenv('FRONTEND_IMAGE_CACHE_ENTRIES','10000'))
+
+
+@st.cache_data(ttl=CACHE_TTL,max_entries=CACHE_ENTRIES,show_spinner=False)
+def predict(payload:dict)->dict:
+    response=client.predict(payload)
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=CACHE_TTL,max_entries=CACHE_ENTRIES,show_spinner=False)
+def plan_day(profile:dict)->dict:
+    response=client.plan_day(profile)
+    response.raise_for_status()
+    return response.json()
+
+@st.cache_data(ttl=IMAGE_CACHE_TTL,max_entries=IMAGE_CACHE_ENTRIES,show_spinner=False)
+def image_link(recipe_name:str,_resolve)->str:
+    # _resolve() looks up the links of all the recipes asked for together, once,
+    # at the first one not memoized. A recipe without a link (nothing found,
+    # failed or slow lookup) raises and is not memoized, the image finder's own
+    # cache answers it next time
+    link=_resolve()[recipe_name]
+    if link==Not_found_link:
+        raise LookupError(recipe_name)
+    return link
+
+def image_links(recipe_names:list)->dict:
+    # Image link of every recipe, the ones not memoized looked up in one batch
+    # through the image finder (its cache read at once, the searches concurrent)
+    names=list(dict.fromkeys(recipe_names))
+    resolve=cache(lambda:find_images(names))
+    links={}
+    for name in names:
+        try:
+            links[name]=image_link(name,resolve)
+        except LookupError:
+            links[name]=Not_found_link
+    return links
+
+async def apredict(payload:dict)->dict:
+    return await asyncio.to_thread(predict,payload)
+
+async def aplan_day(profile:dict)->dict:
+    return await asyncio.to_thread(plan_day,profile)
+
+async def aimage_links(recipe_names:list)->dict:
+    return await asyncio.to_thread(image_links,recipe_names)
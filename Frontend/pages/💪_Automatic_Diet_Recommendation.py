@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
-from Generate_Recommendations import Generator
-from random import uniform as rnd
-from ImageFinder.ImageFinder import  find_image
+from ImageFinder.ImageFinder import  Not_found_link
+from memo import aimage_links, aplan_day
 from streamlit_echarts import st_echarts
 import asyncio
+import logging
+import sqlite3
+import requests
 
 st.set_page_config(page_title="Automatic Diet Recommendation", page_icon="💪",layout="wide")
 st.markdown("""
@@ -59,6 +61,26 @@ if 'person' not in st.session_state:
     st.session_state.recommendations=None
     st.session_state.person=None
     st.session_state.weight_loss_option=None
+
+# Meals whose images are looked up at the same time
+IMAGE_TASKS=3
+
+async def add_image_links(recipes,semaphore):
+    # Image links of the recipes of one meal the backend did not precompute.
+    # Failed searches already come back as the default image, an unreadable
+    # image cache or a closed lookup pool only leaves this meal with it
+    missing=[recipe for recipe in recipes if not recipe.get('image_link')]
+    if not missing:
+        return
+    async with semaphore:
+        try:
+            links=await aimage_links([recipe['Name'] for recipe in missing])
+        except (sqlite3.Error,RuntimeError) as e:
+            logging.getLogger(__name__).warning("Image lookup failed: %s",e)
+            links={}
+    for recipe in missing:
+        recipe['image_link']=links.get(recipe['Name'],Not_found_link)
+
 class Person:
 
     def __init__(self,age,height,weight,gender,activity,meals_calories_perc,weight_loss):
@@ -105,74 +127,34 @@ class Person:
         return maintain_calories
     
 
-    # Define your generate_recommendations function with async/await and rounding to integers
+    # One /plan/day request answers every meal, the backend computes the calorie
+    # needs and the nutrition targets of each meal
     async def generate_recommendations(self):
-     total_calories = self.weight_loss * self.calories_calculator()
-     recommendations = []
-     for meal in self.meals_calories_perc:
-        meal_calories = self.meals_calories_perc[meal] * total_calories
-        if meal == 'breakfast':
-            recommended_nutrition = [
-                int(meal_calories),  # Cast the meal_calories to int
-                int(rnd(10, 30)),    # Random fat content as integer
-                int(rnd(0, 4)),      # Random saturated fat content as integer
-                int(rnd(0, 30)),     # Random cholesterol content as integer
-                int(rnd(0, 400)),    # Random sodium content as integer
-                int(rnd(40, 75)),    # Random carbohydrate content as integer
-                int(rnd(4, 10)),     # Random fiber content as integer
-                int(rnd(0, 10)),     # Random sugar content as integer
-                int(rnd(30, 100)),   # Random protein content as integer
-            ]
-        elif meal == 'lunch':
-            recommended_nutrition = [
-                int(meal_calories),
-                int(rnd(20, 40)),
-                int(rnd(0, 4)),
-                int(rnd(0, 30)),
-                int(rnd(0, 400)),
-                int(rnd(40, 75)),
-                int(rnd(4, 20)),
-                int(rnd(0, 10)),
-                int(rnd(50, 175)),
-            ]
-        elif meal == 'dinner':
-            recommended_nutrition = [
-                int(meal_calories),
-                int(rnd(20, 40)),
-                int(rnd(0, 4)),
-                int(rnd(0, 30)),
-                int(rnd(0, 400)),
-                int(rnd(40, 75)),
-                int(rnd(4, 20)),
-                int(rnd(0, 10)),
-                int(rnd(50, 175)),
-            ]
-        else:
-            recommended_nutrition = [
-                int(meal_calories),
-                int(rnd(10, 30)),
-                int(rnd(0, 4)),
-                int(rnd(0, 30)),
-                int(rnd(0, 400)),
-                int(rnd(40, 75)),
-                int(rnd(4, 10)),
-                int(rnd(0, 10)),
-                int(rnd(30, 100)),
-            ]
-
-        generator = Generator(recommended_nutrition)
-       
-        
-        response = await asyncio.to_thread(generator.generato)
-
-        
-        recommended_recipes = response.json().get('output', [])
-        recommendations.append(recommended_recipes)
-
-    # Add image links (synchronous)
-     for recommendation in recommendations:
-        for recipe in recommendation:
-            recipe['image_link'] = find_image(recipe['Name'])
+     profile = {
+        'age': self.age,
+        'height': self.height,
+        'weight': self.weight,
+        'gender': self.gender,
+        'activity': self.activity,
+        'plan': st.session_state.weight_loss_option,
+        'meals_per_day': len(self.meals_calories_perc),
+        'combinations': 1,
+     }
+     # The same profile asked for before by any session is answered from the memo
+     try:
+        plan = await aplan_day(profile)
+     except (requests.RequestException, ValueError) as e:
+        st.error(f"Could not get recommendations from the API: {e}")
+        return None
+     recommendations = [meal.get('output', []) for meal in plan.get('meals', [])]
+     # Recipes of each meal whose day total is closest to the target calories
+     combinations = plan.get('combinations') or [{'choices': [0] * len(recommendations)}]
+     self.best_choices = combinations[0]['choices']
+
+    # Image links of the meals looked up concurrently, at most IMAGE_TASKS
+    # meals at a time, each meal on its own
+     semaphore = asyncio.Semaphore(IMAGE_TASKS)
+     await asyncio.gather(*(add_image_links(recommendation, semaphore) for recommendation in recommendations))
 
     # Debugging output
       # Check if recommendations are being generated correctly
@@ -242,41 +224,46 @@ class Display:
                                 - Total Time      : {recipe['TotalTime']}min
                             """)                       
 
+    def default_choice(self,person,meal):
+        # Preselected recipe of a meal, the one of the best combination
+        choices=getattr(person,'best_choices',None)
+        return choices[meal] if choices and meal<len(choices) else 0
+
     def display_meal_choices(self,person,recommendations):    
         st.subheader('Choose your meal composition:')
         # Display meal compositions choices
         if len(recommendations)==3:
             breakfast_column,launch_column,dinner_column=st.columns(3)
             with breakfast_column:
-                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]])
+                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]],index=self.default_choice(person,0))
             with launch_column:
-                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[1]])
+                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[1]],index=self.default_choice(person,1))
             with dinner_column:
-                dinner_choice=st.selectbox(f'Choose your dinner:',[recipe['Name'] for recipe in recommendations[2]])  
+                dinner_choice=st.selectbox(f'Choose your dinner:',[recipe['Name'] for recipe in recommendations[2]],index=self.default_choice(person,2))  
             choices=[breakfast_choice,launch_choice,dinner_choice]     
         elif len(recommendations)==4:
             breakfast_column,morning_snack,launch_column,dinner_column=st.columns(4)
             with breakfast_column:
-                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]])
+                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]],index=self.default_choice(person,0))
             with morning_snack:
-                morning_snack=st.selectbox(f'Choose your morning_snack:',[recipe['Name'] for recipe in recommendations[1]])
+                morning_snack=st.selectbox(f'Choose your morning_snack:',[recipe['Name'] for recipe in recommendations[1]],index=self.default_choice(person,1))
             with launch_column:
-                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[2]])
+                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[2]],index=self.default_choice(person,2))
             with dinner_column:
-                dinner_choice=st.selectbox(f'Choose your dinner:',[recipe['Name'] for recipe in recommendations[3]])
+                dinner_choice=st.selectbox(f'Choose your dinner:',[recipe['Name'] for recipe in recommendations[3]],index=self.default_choice(person,3))
             choices=[breakfast_choice,morning_snack,launch_choice,dinner_choice]                
         else:
             breakfast_column,morning_snack,launch_column,afternoon_snack,dinner_column=st.columns(5)
             with breakfast_column:
-                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]])
+                breakfast_choice=st.selectbox(f'Choose your breakfast:',[recipe['Name'] for recipe in recommendations[0]],index=self.default_choice(person,0))
             with morning_snack:
-                morning_snack=st.selectbox(f'Choose your morning_snack:',[recipe['Name'] for recipe in recommendations[1]])
+                morning_snack=st.selectbox(f'Choose your morning_snack:',[recipe['Name'] for recipe in recommendations[1]],index=self.default_choice(person,1))
             with launch_column:
-                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[2]])
+                launch_choice=st.selectbox(f'Choose your launch:',[recipe['Name'] for recipe in recommendations[2]],index=self.default_choice(person,2))
             with afternoon_snack:
-                afternoon_snack=st.selectbox(f'Choose your afternoon:',[recipe['Name'] for recipe in recommendations[3]])
+                afternoon_snack=st.selectbox(f'Choose your afternoon:',[recipe['Name'] for recipe in recommendations[3]],index=self.default_choice(person,3))
             with dinner_column:
-                dinner_choice=st.selectbox(f'Choose your  dinner:',[recipe['Name'] for recipe in recommendations[4]])
+                dinner_choice=st.selectbox(f'Choose your  dinner:',[recipe['Name'] for recipe in recommendations[4]],index=self.default_choice(person,4))
             choices=[breakfast_choice,morning_snack,launch_choice,afternoon_snack,dinner_choice] 
         
         # Calculating the sum of nutritional values of the choosen recipes
@@ -1,9 +1,9 @@
 import json
-import aiohttp
 import asyncio
+import requests
 import streamlit as st
 from Generate_Recommendations import Generator
-from ImageFinder.ImageFinder import  find_image
+from memo import aimage_links, apredict
 import pandas as pd
 from streamlit_echarts import st_echarts
 
@@ -33,20 +33,26 @@ class Recommendation:
         ingredients = self.input_data["ingredients"].split(';')
         generator = Generator(self.input_data["nutrition_input"], ingredients, self.input_data["params"])
         
-        # Perform the asynchronous HTTP request using aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.post('http://127.0.0.1:8000/predict/', json=self.input_data) as response:
-                if response.status == 200:
-                    recommendations = await response.json()  # Await the response to get the JSON data
-                    if recommendations.get('output'):
-                        recommendations = recommendations['output']
-                        # Add image links for each recommendation asynchronously
-                        for recipe in recommendations:
-                            recipe['image_link'] =  find_image(recipe['Name'])
-                        return recommendations
-                else:
-                    st.error("Failed to get recommendations from the API.")
-                    return []
+        # Perform the HTTP request through the shared pooled client, the same
+        # request made before by any session is answered from the memo
+        try:
+            recommendations = await apredict(generator.request())
+        except requests.HTTPError:
+            st.error("Failed to get recommendations from the API.")
+            return []
+        except requests.RequestException as e:
+            st.error(f"Could not reach the recommendation API: {e}")
+            return []
+        if recommendations.get('output'):
+            recommendations = recommendations['output']
+            # Add the image links the backend did not precompute,
+            # looked up concurrently off the event loop
+            missing = [recipe for recipe in recommendations if not recipe.get('image_link')]
+            if missing:
+                links = await aimage_links([recipe['Name'] for recipe in missing])
+                for recipe in missing:
+                    recipe['image_link'] = links[recipe['Name']]
+            return recommendations
 
 class Display:
     def __init__(self):
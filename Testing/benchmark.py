@@ -0,0 +1,187 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import sklearn
+from synthetic import write_corpus
+
+BACKEND=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Backend')
+sys.path.insert(0,BACKEND)
+
+from model import (apply_pipeline, build_pipeline, extract_ingredient_filtered_data, extract_quoted_strings,
+                   nn_predictor, output_recommended_recipes, scaling)
+
+# Benchmark of the recommendation hot path over synthetic corpora (see
+# synthetic.py) of several sizes, e.g.
+#   python benchmark.py --sizes 20000 100000 1000000 --output benchmark.json
+# Every stage runs up to --repeat times, or less once it took --budget seconds,
+# and reports its latency percentiles and throughput:
+#   extract_ingredient_filtered_data  regex filter of the corpus on 1-2 ingredients
+#   scaling                           StandardScaler fit over the corpus
+#   nn_predictor                      NearestNeighbors fit over the scaled corpus
+#   apply_pipeline                    query of the fitted pipeline
+#   output_recommended_recipes        records of the n_neighbors results
+#   predict                           POST /predict/ on Backend/main.py through
+#                                     an in-process test client, the response
+#                                     cache disabled
+# The queries are corpus recipes with jittered nutrition and, for the filtered
+# ones, ingredients taken from the recipe so that the subset is never empty.
+
+STAGES=['extract_ingredient_filtered_data','scaling','nn_predictor','apply_pipeline','output_recommended_recipes','predict']
+
+
+def percentile_ms(latencies,q):
+    return round(float(np.percentile(latencies,q))*1000,4)
+
+def summary(latencies,rows=None):
+    total=sum(latencies)
+    result={
+        'runs':len(latencies),
+        'mean_ms':round(total/len(latencies)*1000,4),
+        'p50_ms':percentile_ms(latencies,50),
+        'p95_ms':percentile_ms(latencies,95),
+        'p99_ms':percentile_ms(latencies,99),
+        'ops_per_s':round(len(latencies)/total,2),
+    }
+    if rows is not None:
+        # Corpus rows processed per second
+        result['rows_per_s']=round(rows*len(latencies)/total,1)
+    return result
+
+def timed(function,arguments,repeat,budget):
+    # Latencies of function over the arguments, cycled, at least 3 runs
+    latencies=[]
+    results=[]
+    started=time.perf_counter()
+    for i in range(repeat):
+        args=arguments[i%len(arguments)]
+        start=time.perf_counter()
+        results.append(function(*args))
+        latencies.append(time.perf_counter()-start)
+        if i>=2 and time.perf_counter()-started>budget:
+            break
+    return latencies,results
+
+def make_queries(dataframe,n_queries,max_ingredients,rng):
+    rows=rng.integers(0,dataframe.shape[0],n_queries)
+    nutrition=dataframe.iloc[rows,6:15].to_numpy(dtype=np.float64)*rng.lognormal(0.0,0.2,(n_queries,9))
+    ingredients=[]
+    for row in rows:
+        parts=extract_quoted_strings(dataframe['RecipeIngredientParts'].iat[row])
+        picked=rng.choice(len(parts),size=min(len(parts),int(rng.integers(1,max_ingredients+1))),replace=False)
+        ingredients.append([parts[i] for i in sorted(picked)])
+    return [[float(value) for value in row] for row in nutrition],ingredients
+
+def load_backend(data_path,workdir,cache_size=0):
+    # Backend/main.py serving data_path, imported again for every corpus
+    os.environ['RECOMMENDER_DATA']=data_path
+    os.environ['RECOMMENDER_ARTIFACT']=os.path.join(workdir,'missing.artifact')
+    os.environ['RECOMMENDER_JOURNAL']=os.path.join(workdir,'journal.ndjson')
+    os.environ['RECOMMENDER_CACHE_SIZE']=str(cache_size)
+    if 'main' in sys.modules:
+        return importlib.reload(sys.modules['main'])
+    return importlib.import_module('main')
+
+def run_size(n_rows,args,workdir):
+    from fastapi.testclient import TestClient
+    rng=np.random.default_rng(args.seed)
+    data_path=write_corpus(args.corpora,n_rows,args.seed)
+    dataframe=pd.read_csv(data_path)
+    inputs,ingredients=make_queries(dataframe,args.queries,args.max_ingredients,rng)
+    params={'n_neighbors':args.n_neighbors,'return_distance':False}
+    stages={}
+
+    if 'extract_ingredient_filtered_data' in args.stages:
+        latencies,subsets=timed(lambda query:extract_ingredient_filtered_data(dataframe,query),[[query] for query in ingredients],args.repeat,args.budget)
+        stages['extract_ingredient_filtered_data']=summary(latencies,n_rows)
+        stages['extract_ingredient_filtered_data']['mean_subset_rows']=round(float(np.mean([subset.shape[0] for subset in subsets])),1)
+
+    latencies,fitted=timed(lambda:scaling(dataframe),[()],args.repeat,args.budget)
+    stages['scaling']=summary(latencies,n_rows)
+    prep_data,scaler=fitted[-1]
+    del fitted
+
+    latencies,fitted=timed(lambda:nn_predictor(prep_data),[()],args.repeat,args.budget)
+    stages['nn_predictor']=summary(latencies,n_rows)
+    pipeline=build_pipeline(fitted[-1],scaler,params)
+    del fitted
+
+    # The pipeline results feed output_recommended_recipes
+    latencies,found=timed(lambda _input:apply_pipeline(pipeline,_input,dataframe),[[_input] for _input in inputs],args.repeat,args.budget)
+    stages['apply_pipeline']=summary(latencies,n_rows)
+
+    latencies,_=timed(output_recommended_recipes,[[result] for result in found],args.repeat,args.budget)
+    stages['output_recommended_recipes']=summary(latencies)
+    del found,pipeline,prep_data
+    if 'predict' not in args.stages:
+        return {'rows':n_rows,'stages':{stage:stages[stage] for stage in STAGES if stage in args.stages}}
+
+    start=time.perf_counter()
+    backend=load_backend(data_path,workdir)
+    load_s=time.perf_counter()-start
+    client=TestClient(backend.app)
+    filtered=rng.random(args.queries)<args.filtered_share
+    payloads=[{'nutrition_input':_input,'ingredients':';'.join(query) if use else None,'params':params}
+              for _input,query,use in zip(inputs,ingredients,filtered)]
+    def predict(payload):
+        response=client.post('/predict/',json=payload)
+        response.raise_for_status()
+        return len(response.content)
+    latencies,sizes=timed(predict,[[payload] for payload in payloads],args.repeat,args.budget)
+    stages['predict']=summary(latencies)
+    stages['predict'].update({
+        'load_s':round(load_s,3),
+        'filtered_share':args.filtered_share,
+        'mean_response_bytes':round(float(np.mean(sizes)),1),
+    })
+    return {'rows':n_rows,'stages':{stage:stages[stage] for stage in STAGES if stage in args.stages}}
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmark of the recommendation hot path')
+    parser.add_argument('--sizes',type=int,nargs='+',default=[20000,100000,1000000])
+    parser.add_argument('--stages',nargs='+',default=STAGES,choices=STAGES,
+                        help='the regex filter alone takes minutes per run at 1M rows')
+    parser.add_argument('--repeat',type=int,default=200,help='maximum runs of each stage')
+    parser.add_argument('--budget',type=float,default=20.0,help='seconds after which a stage stops repeating')
+    parser.add_argument('--queries',type=int,default=200)
+    parser.add_argument('--n-neighbors',type=int,default=5)
+    parser.add_argument('--max-ingredients',type=int,default=2)
+    parser.add_argument('--filtered-share',type=float,default=0.5,help='share of the /predict/ calls filtered on ingredients')
+    parser.add_argument('--corpora',default='corpora',help='directory of the generated corpora, reused between runs')
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',help='write the report as JSON to this file')
+    args=parser.parse_args()
+
+    report={
+        'environment':{
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'pandas':pd.__version__,
+            'sklearn':sklearn.__version__,
+            'cpus':os.cpu_count(),
+            'machine':platform.machine(),
+        },
+        'settings':{key:value for key,value in vars(args).items() if key not in ('output','corpora')},
+        'results':[],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_rows in args.sizes:
+            result=run_size(n_rows,args,workdir)
+            report['results'].append(result)
+            for stage,stats in result['stages'].items():
+                print(f"{n_rows:>8} {stage:34} p50={stats['p50_ms']:.3f}ms p95={stats['p95_ms']:.3f}ms "
+                      f"p99={stats['p99_ms']:.3f}ms {stats['ops_per_s']}/s",flush=True)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=2)
+    else:
+        print(json.dumps(report,indent=2))
+
+if __name__=='__main__':
+    main()
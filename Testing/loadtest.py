@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import httpx
+from benchmark import load_backend, make_queries, percentile_ms
+from memory_db import MemoryDatabase
+from synthetic import write_corpus
+
+ADMIN=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Admin','main.py')
+
+# Load generator for the recommendation backend (/predict/) and the auth
+# service (/login, /profile). Concurrent clients send a weighted mix of
+# requests for --duration seconds at each --concurrency step, and the report
+# gives the throughput and latency percentiles of every step, e.g.
+#   python loadtest.py --concurrency 1 2 4 8 16 32 --mix predict_plain=6 predict_filtered=3 login=1 profile=4
+# By default both services run in process, the backend over a synthetic corpus
+# and Admin/main.py over an in-memory database (memory_db.py), so no MongoDB is
+# needed. --backend-url and --admin-url point the load at running servers
+# instead, which measures the real server stack:
+#   uvicorn main:app --workers 4                 (Backend/)
+#   python loadtest.py --backend-url http://127.0.0.1:8000 --mix predict_plain=1
+# In process, the clients share the CPU with the services.
+#
+# The scenarios:
+#   predict_plain     POST /predict/ without ingredients
+#   predict_filtered  POST /predict/ with 1 to --max-ingredients ingredients
+#   login             POST /login of a random user, a bcrypt check
+#   profile           GET /profile with the token of a random user
+# The n_neighbors of every /predict/ is drawn from --n-neighbors.
+
+SCENARIOS=['predict_plain','predict_filtered','login','profile']
+PASSWORD='loadtest-password'
+
+
+def parse_mix(items):
+    mix={}
+    for item in items:
+        name,_,weight=item.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', expected one of {SCENARIOS}")
+        mix[name]=float(weight or 1)
+    return mix
+
+def load_admin():
+    # Admin/main.py under another module name than the backend main, its
+    # database swapped for the in-memory one
+    spec=importlib.util.spec_from_file_location('admin_main',ADMIN)
+    admin=importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(admin)
+    admin.db=MemoryDatabase()
+    return admin
+
+def asgi_client(app,name):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app),base_url=f'http://{name}',timeout=None)
+
+def latency_summary(latencies,seconds):
+    if not latencies:
+        return {'requests':0,'rps':0.0}
+    return {
+        'requests':len(latencies),
+        'rps':round(len(latencies)/seconds,2),
+        'p50_ms':percentile_ms(latencies,50),
+        'p95_ms':percentile_ms(latencies,95),
+        'p99_ms':percentile_ms(latencies,99),
+        'max_ms':round(max(latencies)*1000,4),
+    }
+
+
+class LoadTest:
+    def __init__(self,backend,admin,mix,payloads,users,n_neighbors,seed=0):
+        self.backend=backend
+        self.admin=admin
+        self.scenarios=list(mix)
+        self.weights=[mix[name] for name in self.scenarios]
+        self.payloads=payloads
+        self.users=users
+        self.tokens={}
+        self.n_neighbors=n_neighbors
+        self.rng=random.Random(seed)
+
+    async def signup_users(self):
+        # Existing users (a running Admin service) are answered 400 and kept
+        for email in self.users:
+            response=await self.admin.post('/signup',json={'email':email,'username':email.split('@')[0],'password':PASSWORD})
+            if response.status_code not in (200,400):
+                response.raise_for_status()
+        for email in self.users:
+            self.tokens[email]=(await self.login(email)).json()['access_token']
+
+    async def login(self,email):
+        return await self.admin.post('/login',data={'username':email,'password':PASSWORD})
+
+    async def request(self,scenario):
+        if scenario in ('predict_plain','predict_filtered'):
+            payload=dict(self.rng.choice(self.payloads[scenario]))
+            payload['params']={'n_neighbors':self.rng.choice(self.n_neighbors),'return_distance':False}
+            return await self.backend.post('/predict/',json=payload)
+        email=self.rng.choice(self.users)
+        if scenario=='login':
+            return await self.login(email)
+        return await self.admin.get('/profile',headers={'Authorization':f'Bearer {self.tokens[email]}'})
+
+    async def client(self,stop,samples):
+        while time.perf_counter()<stop:
+            scenario=self.rng.choices(self.scenarios,self.weights)[0]
+            start=time.perf_counter()
+            try:
+                status=(await self.request(scenario)).status_code
+            except httpx.HTTPError as error:
+                status=type(error).__name__
+            samples.append((scenario,time.perf_counter()-start,status))
+
+    async def step(self,concurrency,duration,warmup):
+        if warmup:
+            await asyncio.gather(*(self.client(time.perf_counter()+warmup,[]) for _ in range(concurrency)))
+        samples=[]
+        started=time.perf_counter()
+        await asyncio.gather(*(self.client(started+duration,samples) for _ in range(concurrency)))
+        # Requests still running at the deadline finish, and count
+        seconds=time.perf_counter()-started
+        ok=[latency for _,latency,status in samples if status==200]
+        errors={}
+        for _,_,status in samples:
+            if status!=200:
+                errors[str(status)]=errors.get(str(status),0)+1
+        result={'concurrency':concurrency,'seconds':round(seconds,3),**latency_summary(ok,seconds),'errors':errors,'scenarios':{}}
+        for scenario in self.scenarios:
+            latencies=[latency for name,latency,status in samples if name==scenario and status==200]
+            result['scenarios'][scenario]=latency_summary(latencies,seconds)
+        return result
+
+
+async def run(args,workdir):
+    mix=parse_mix(args.mix)
+    rng=np.random.default_rng(args.seed)
+    clients=[]
+    backend=admin=None
+    if 'predict_plain' in mix or 'predict_filtered' in mix:
+        data_path=args.data or write_corpus(args.corpora,args.rows,args.seed)
+        inputs,ingredients=make_queries(pd.read_csv(data_path),args.queries,args.max_ingredients,rng)
+        if args.backend_url:
+            backend=httpx.AsyncClient(base_url=args.backend_url,timeout=args.timeout)
+        else:
+            backend=asgi_client(load_backend(data_path,workdir,args.cache_size).app,'backend')
+        clients.append(backend)
+    else:
+        inputs,ingredients=[],[]
+    payloads={
+        'predict_plain':[{'nutrition_input':_input,'ingredients':None} for _input in inputs],
+        'predict_filtered':[{'nutrition_input':_input,'ingredients':';'.join(query)} for _input,query in zip(inputs,ingredients)],
+    }
+    if 'login' in mix or 'profile' in mix:
+        if args.admin_url:
+            admin=httpx.AsyncClient(base_url=args.admin_url,timeout=args.timeout)
+        else:
+            admin=asgi_client(load_admin().app,'admin')
+        clients.append(admin)
+    users=[f'loadtest{i}@example.com' for i in range(args.users)]
+    test=LoadTest(backend,admin,mix,payloads,users,args.n_neighbors,args.seed)
+    try:
+        if admin is not None:
+            await test.signup_users()
+        steps=[]
+        for concurrency in args.concurrency:
+            result=await test.step(concurrency,args.duration,args.warmup)
+            steps.append(result)
+            print(f"c={concurrency:<4} {result['rps']:>9.2f} req/s p50={result.get('p50_ms',0):.2f}ms "
+                  f"p95={result.get('p95_ms',0):.2f}ms p99={result.get('p99_ms',0):.2f}ms errors={sum(result['errors'].values())}",flush=True)
+            if args.stop_p99 and result.get('p99_ms',0)>args.stop_p99:
+                break
+        return steps
+    finally:
+        for client in clients:
+            await client.aclose()
+
+def main():
+    parser=argparse.ArgumentParser(description='Load test of /predict/ and the auth service')
+    parser.add_argument('--concurrency',type=int,nargs='+',default=[1,2,4,8,16,32],help='concurrent clients of each step')
+    parser.add_argument('--duration',type=float,default=10.0,help='seconds measured per step')
+    parser.add_argument('--warmup',type=float,default=1.0,help='seconds run before measuring each step')
+    parser.add_argument('--mix',nargs='+',default=['predict_plain=6','predict_filtered=3','login=1','profile=4'],
+                        help='scenario=weight, from '+', '.join(SCENARIOS))
+    parser.add_argument('--n-neighbors',type=int,nargs='+',default=[5,10,20])
+    parser.add_argument('--max-ingredients',type=int,default=2)
+    parser.add_argument('--stop-p99',type=float,default=0,help='stop once the p99 of a step exceeds this many ms')
+    parser.add_argument('--backend-url',help='running backend, instead of Backend/main.py in process')
+    parser.add_argument('--admin-url',help='running auth service, instead of Admin/main.py in process')
+    parser.add_argument('--timeout',type=float,default=30.0,help='request timeout against running servers')
+    parser.add_argument('--data',help='recipe CSV of the in-process backend, a synthetic corpus otherwise')
+    parser.add_argument('--rows',type=int,default=20000,help='size of the synthetic corpus')
+    parser.add_argument('--corpora',default='corpora')
+    parser.add_argument('--cache-size',type=int,default=0,help='response cache of the in-process backend')
+    parser.add_argument('--queries',type=int,default=500)
+    parser.add_argument('--users',type=int,default=20)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',help='write the report as JSON to this file')
+    args=parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        steps=asyncio.run(run(args,workdir))
+    report={'settings':{key:value for key,value in vars(args).items() if key not in ('output','corpora')},'steps':steps}
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(report,f,indent=2)
+    else:
+        print(json.dumps(report,indent=2))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,100 @@
+import copy
+from bson import ObjectId
+
+# In-memory stand-in for the motor database of Admin/main.py, covering the
+# calls it makes on db.users: find_one, find().to_list, insert_one, update_one
+# with $set and delete_one, with filters matching fields by equality. Documents
+# are copied in and out like they would be through the driver.
+
+
+class InsertOneResult:
+    def __init__(self,inserted_id):
+        self.inserted_id=inserted_id
+
+class UpdateResult:
+    def __init__(self,matched_count,modified_count):
+        self.matched_count=matched_count
+        self.modified_count=modified_count
+
+class DeleteResult:
+    def __init__(self,deleted_count):
+        self.deleted_count=deleted_count
+
+
+def matches(document,filter):
+    return all(document.get(field)==value for field,value in (filter or {}).items())
+
+
+class MemoryCursor:
+    def __init__(self,documents):
+        self.documents=documents
+
+    async def to_list(self,length=None):
+        return [copy.deepcopy(document) for document in self.documents[:length]]
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.documents=[]
+        # Documents by the value of their indexed field, for the lookups of
+        # every request
+        self.index_field='email'
+        self.by_field={}
+
+    def matching(self,filter):
+        filter=filter or {}
+        if set(filter)=={self.index_field}:
+            document=self.by_field.get(filter[self.index_field])
+            return [document] if document is not None else []
+        return [document for document in self.documents if matches(document,filter)]
+
+    async def find_one(self,filter=None):
+        found=self.matching(filter)
+        return copy.deepcopy(found[0]) if found else None
+
+    def find(self,filter=None):
+        return MemoryCursor(self.matching(filter))
+
+    async def insert_one(self,document):
+        document.setdefault('_id',ObjectId())
+        stored=copy.deepcopy(document)
+        self.documents.append(stored)
+        if self.index_field in stored:
+            self.by_field.setdefault(stored[self.index_field],stored)
+        return InsertOneResult(document['_id'])
+
+    async def update_one(self,filter,update):
+        found=self.matching(filter)
+        if not found:
+            return UpdateResult(0,0)
+        document=found[0]
+        changes={field:value for field,value in update.get('$set',{}).items() if document.get(field)!=value}
+        if self.index_field in changes and self.by_field.get(document.get(self.index_field)) is document:
+            del self.by_field[document[self.index_field]]
+        document.update(copy.deepcopy(changes))
+        if self.index_field in changes:
+            self.by_field.setdefault(document[self.index_field],document)
+        return UpdateResult(1,int(bool(changes)))
+
+    async def delete_one(self,filter):
+        found=self.matching(filter)
+        if not found:
+            return DeleteResult(0)
+        document=found[0]
+        self.documents=[stored for stored in self.documents if stored is not document]
+        if self.by_field.get(document.get(self.index_field)) is document:
+            del self.by_field[document[self.index_field]]
+        return DeleteResult(1)
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self.collections={}
+
+    def __getitem__(self,name):
+        return self.collections.setdefault(name,MemoryCollection())
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,113 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic recipe corpora with the schema of last_20000_rows.csv: the same
+# columns in the same order, durations as ISO 8601 strings and the ingredients
+# and instructions as R character vectors, c("...", "..."). Ingredients follow a
+# Zipf law over the vocabulary, so a few are in most recipes and most are rare,
+# and the nutrition values are log-normal around typical servings. The corpus
+# only depends on the row count and the seed, e.g.
+#   python synthetic.py 100000 --output corpora/recipes_100000.csv
+
+COLUMNS=['RecipeId','Name','CookTime','PrepTime','TotalTime','RecipeIngredientParts',
+         'Calories','FatContent','SaturatedFatContent','CholesterolContent','SodiumContent',
+         'CarbohydrateContent','FiberContent','SugarContent','ProteinContent','RecipeInstructions']
+
+BASE_INGREDIENTS=['salt','butter','sugar','eggs','onion','garlic','water','flour','milk','olive oil',
+    'pepper','brown sugar','vanilla','baking soda','lemon juice','parmesan cheese','baking powder',
+    'cinnamon','sour cream','cheddar cheese','chicken breast','tomatoes','honey','carrots','celery',
+    'ground beef','potatoes','rice','cream cheese','mushrooms','bacon','spinach','basil','oregano',
+    'paprika','cumin','ginger','soy sauce','vinegar','mayonnaise','walnuts','pecans','oats','yogurt',
+    'zucchini','broccoli','corn','black beans','chickpeas','lentils','tofu','shrimp','salmon','tuna',
+    'pork','lamb','turkey','bell pepper','jalapeno','cilantro','parsley','thyme','rosemary','nutmeg',
+    'cocoa','chocolate chips','coconut milk','peanut butter','almonds','raisins','apples','bananas',
+    'strawberries','blueberries','oranges','lime juice','heavy cream','mozzarella cheese','feta cheese',
+    'pasta','noodles','bread crumbs','cornstarch','chicken broth','beef broth','tomato paste','mustard',
+    'worcestershire sauce','maple syrup','sesame oil','green onions','shallots','cabbage','kale',
+    'sweet potatoes','pumpkin','eggplant','avocado','quinoa','couscous']
+MODIFIERS=['','fresh ','dried ','ground ','chopped ','frozen ','low-fat ','organic ','smoked ','unsalted ']
+
+NAME_STYLES=['Easy','Quick','Classic','Spicy','Creamy','Baked','Grilled','Healthy','Homemade','Slow Cooker']
+DISHES=['Soup','Salad','Casserole','Stew','Pie','Bowl','Curry','Muffins','Stir Fry','Pasta','Bread','Tacos']
+STEPS=['Preheat oven to 350 degrees F.','Combine all ingredients in a large bowl.','Stir until well blended.',
+       'Heat the oil in a skillet over medium heat.','Add the onion and cook until soft.',
+       'Season with salt and pepper.','Bring to a boil, then reduce heat and simmer.',
+       'Pour into a greased baking dish.','Bake for 30 minutes or until golden.',
+       'Let cool before serving.','Serve warm.','Garnish with fresh herbs.']
+
+# Median and log standard deviation of each nutrition column, per serving
+NUTRITION=[(350,0.8),(14,1.0),(4.5,1.1),(40,1.4),(450,1.0),(35,0.9),(2.5,0.9),(8,1.2),(14,1.0)]
+
+
+def vocabulary():
+    return [modifier+ingredient for modifier in MODIFIERS for ingredient in BASE_INGREDIENTS]
+
+def r_vector(strings):
+    return 'c('+', '.join('"'+string.replace('"','\\"')+'"' for string in strings)+')'
+
+def duration(minutes):
+    hours,minutes=divmod(int(minutes),60)
+    return 'PT'+(f'{hours}H' if hours else '')+(f'{minutes}M' if minutes or not hours else '')
+
+def generate(n_rows,seed=0):
+    rng=np.random.default_rng(seed)
+    names=vocabulary()
+    weights=1.0/np.arange(1,len(names)+1)**1.1
+    # Shuffled so that the modifiers do not all land in the tail
+    ranks=rng.permutation(len(names))
+    weights=weights[ranks]/weights.sum()
+    counts=rng.integers(3,13,n_rows)
+    drawn=rng.choice(len(names),size=int(counts.sum()),p=weights)
+    bounds=np.concatenate([[0],np.cumsum(counts)])
+    ingredient_parts=[r_vector([names[i] for i in dict.fromkeys(drawn[bounds[row]:bounds[row+1]].tolist())]) for row in range(n_rows)]
+
+    n_steps=rng.integers(2,9,n_rows)
+    steps=rng.integers(0,len(STEPS),int(n_steps.sum()))
+    step_bounds=np.concatenate([[0],np.cumsum(n_steps)])
+    instructions=[r_vector([STEPS[i] for i in steps[step_bounds[row]:step_bounds[row+1]]]) for row in range(n_rows)]
+
+    cook=np.round(rng.lognormal(np.log(30),0.8,n_rows)/5)*5
+    prep=np.round(rng.lognormal(np.log(15),0.6,n_rows)/5)*5
+    styles=rng.integers(0,len(NAME_STYLES),n_rows)
+    dishes=rng.integers(0,len(DISHES),n_rows)
+    mains=drawn[bounds[:-1]]
+    dataframe=pd.DataFrame({
+        'RecipeId':np.arange(1,n_rows+1),
+        'Name':[f'{NAME_STYLES[s]} {names[m].title()} {DISHES[d]}' for s,m,d in zip(styles,mains,dishes)],
+        'CookTime':[duration(minutes) for minutes in cook],
+        'PrepTime':[duration(minutes) for minutes in prep],
+        'TotalTime':[duration(minutes) for minutes in cook+prep],
+        'RecipeIngredientParts':ingredient_parts,
+    })
+    for column,(median,sigma) in zip(COLUMNS[6:15],NUTRITION):
+        dataframe[column]=np.round(rng.lognormal(np.log(median),sigma,n_rows),1)
+    dataframe['RecipeInstructions']=instructions
+    return dataframe
+
+def corpus_path(directory,n_rows,seed=0):
+    return os.path.join(directory,f'recipes_{n_rows}_{seed}.csv')
+
+def write_corpus(directory,n_rows,seed=0):
+    # Generated once, later runs reuse the file
+    path=corpus_path(directory,n_rows,seed)
+    if not os.path.isfile(path):
+        os.makedirs(directory,exist_ok=True)
+        generate(n_rows,seed).to_csv(path+'.tmp',index=False)
+        os.replace(path+'.tmp',path)
+    return path
+
+def main():
+    parser=argparse.ArgumentParser(description='Write a synthetic recipe corpus')
+    parser.add_argument('rows',type=int)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',help='defaults to corpora/recipes_<rows>_<seed>.csv')
+    args=parser.parse_args()
+    path=args.output or corpus_path('corpora',args.rows,args.seed)
+    os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+    generate(args.rows,args.seed).to_csv(path,index=False)
+    print(f"Wrote {args.rows} recipes to {path}")
+
+if __name__=='__main__':
+    main()